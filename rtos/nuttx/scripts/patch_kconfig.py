@@ -3,69 +3,82 @@
 Patch NuttX arch/risc-v/Kconfig to add KCORE configuration
 """
 import sys
+from pathlib import Path
+
+KCORE_CONFIG = (
+    'config ARCH_CHIP_KCORE\n'
+    '\tbool "KCORE"\n'
+    '\tselect ARCH_RV32\n'
+    '\tselect ARCH_RV_ISA_M\n'
+    '\t# Atomic instructions not fully tested yet - disabled\n'
+    '\t# select ARCH_RV_ISA_A\n'
+    '\t---help---\n'
+    '\t\tKCORE custom RISC-V processor\n'
+    '\n'
+)
+KCORE_DEFAULT = '\tdefault "kcore"\t\t\tif ARCH_CHIP_KCORE\n'
+KCORE_SOURCE = (
+    'if ARCH_CHIP_KCORE\n'
+    'source "arch/risc-v/src/kcore/Kconfig"\n'
+    'endif\n'
+)
+
+def line_offset(text, pos, lines_after=0):
+    """Offset of the line start `lines_after` lines below the line containing pos"""
+    start = text.rfind('\n', 0, pos) + 1
+    for _ in range(lines_after):
+        nl = text.find('\n', start)
+        if nl < 0:
+            return len(text)
+        start = nl + 1
+    return start
 
 def patch_kconfig(kconfig_file):
-    with open(kconfig_file, 'r') as f:
-        lines = f.readlines()
+    path = Path(kconfig_file)
+    text = path.read_text()
     
     # Check if already patched
-    for line in lines:
-        if 'CONFIG_ARCH_CHIP_KCORE' in line or 'config ARCH_CHIP_KCORE' in line:
-            print("Kconfig already patched")
-            return True
+    if 'CONFIG_ARCH_CHIP_KCORE' in text or 'config ARCH_CHIP_KCORE' in text:
+        print("Kconfig already patched")
+        return True
     
-    # 1. Insert KCORE config before ESP32C3_LEGACY
-    insert_idx = None
-    for i, line in enumerate(lines):
-        if 'config ARCH_CHIP_ESP32C3_LEGACY' in line:
-            insert_idx = i
-            break
+    inserts = []
     
-    if insert_idx:
-        kcore_lines = [
-            'config ARCH_CHIP_KCORE\n',
-            '\tbool "KCORE"\n',
-            '\tselect ARCH_RV32\n',
-            '\tselect ARCH_RV_ISA_M\n',
-            '\t# Atomic instructions not fully tested yet - disabled\n',
-            '\t# select ARCH_RV_ISA_A\n',
-            '\t---help---\n',
-            '\t\tKCORE custom RISC-V processor\n',
-            '\n',
-        ]
-        lines[insert_idx:insert_idx] = kcore_lines
-        print(f"✓ Inserted KCORE config at line {insert_idx}")
+    # 1. Insert KCORE config before ESP32C3_LEGACY
+    pos = text.find('config ARCH_CHIP_ESP32C3_LEGACY')
+    if pos >= 0:
+        inserts.append((line_offset(text, pos), KCORE_CONFIG, "KCORE config"))
     
     # 2. Add default line after bl602
-    insert_idx = None
-    for i, line in enumerate(lines):
-        if 'default "bl602"' in line and 'ARCH_CHIP_BL602' in line:
-            insert_idx = i + 1
+    pos = text.find('default "bl602"')
+    while pos >= 0:
+        start = line_offset(text, pos)
+        end = line_offset(text, pos, 1)
+        if 'ARCH_CHIP_BL602' in text[start:end]:
+            inserts.append((end, KCORE_DEFAULT, "kcore default"))
             break
-    
-    if insert_idx:
-        lines[insert_idx:insert_idx] = ['\tdefault "kcore"\t\t\tif ARCH_CHIP_KCORE\n']
-        print(f"✓ Inserted kcore default at line {insert_idx}")
+        pos = text.find('default "bl602"', end)
     
     # 3. Add source statement after bl602
-    insert_idx = None
-    for i, line in enumerate(lines):
-        if 'source "arch/risc-v/src/bl602/Kconfig"' in line:
-            insert_idx = i + 4  # After endif
-            break
+    pos = text.find('source "arch/risc-v/src/bl602/Kconfig"')
+    if pos >= 0:
+        inserts.append((line_offset(text, pos, 4), KCORE_SOURCE, "kcore source"))  # After endif
     
-    if insert_idx:
-        source_lines = [
-            'if ARCH_CHIP_KCORE\n',
-            'source "arch/risc-v/src/kcore/Kconfig"\n',
-            'endif\n',
-        ]
-        lines[insert_idx:insert_idx] = source_lines
-        print(f"✓ Inserted kcore source at line {insert_idx}")
+    # Splice all blocks in file order into one new string
+    parts = []
+    prev = 0
+    added_lines = 0
+    for offset, block, what in sorted(inserts, key=lambda x: x[0]):
+        parts.append(text[prev:offset])
+        parts.append(block)
+        prev = offset
+        line = text.count('\n', 0, offset) + added_lines
+        print(f"✓ Inserted {what} at line {line}")
+        added_lines += block.count('\n')
+    parts.append(text[prev:])
     
     # Write patched file
-    with open(kconfig_file, 'w') as f:
-        f.writelines(lines)
+    path.write_text(''.join(parts))
     
     print("✓ Kconfig patched successfully")
     return True
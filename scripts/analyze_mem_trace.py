@@ -1,154 +1,181 @@
 #!/usr/bin/env python3
+import os
 import re
 import sys
+import mmap
+import stat
+from array import array
+from binascii import unhexlify, Error as HexError
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# One pattern for all transaction kinds, matched with finditer over the mapped log
+MEM_TRACE_RE = re.compile(
+    rb'(?m)^\[(CPU_IMEM|CPU_DMEM|AXI_MEM) (WRITE|READ )\] addr=0x([0-9a-f]+) data=0x([0-9a-f]+)')
+
+def _hex(digits):
+    """Value of a hex digit string from a log line"""
+    # unhexlify + from_bytes is a faster C path than int(x, 16), but only
+    # takes an even number of digits
+    try:
+        return int.from_bytes(unhexlify(digits), 'big')
+    except HexError:
+        return int(digits, 16)
+
+def tally(keys):
+    """Multiset of transaction keys (NumPy unique/counts, or a Counter)"""
+    if np is None:
+        return Counter(keys)
+    return np.unique(np.frombuffer(keys, dtype=np.uint64), return_counts=True)
+
+def common_count(a, b):
+    """Number of transactions in both multisets, counted with multiplicity"""
+    if np is None:
+        return sum((a & b).values())
+    (keys_a, counts_a), (keys_b, counts_b) = a, b
+    _, ia, ib = np.intersect1d(keys_a, keys_b, assume_unique=True, return_indices=True)
+    return int(np.minimum(counts_a[ia], counts_b[ib]).sum())
+
+def report(line=''):
+    """Queue a line of the verification report (written once at the end)"""
+    report_lines.append(line + '\n')
+
+report_lines = []
 
 # Parse memory trace log
-cpu_imem_reads = []
-cpu_dmem_writes = []
-cpu_dmem_reads = []
-axi_writes = []
-axi_reads = []
+# Each transaction is stored as one uint64 key: addr << 32 | data
+cpu_imem_reads = array('Q')
+cpu_dmem_writes = array('Q')
+cpu_dmem_reads = array('Q')
+axi_writes = array('Q')
+axi_reads = array('Q')
+
+# (interface, operation) -> array that collects its transaction keys
+targets = {
+    (b'CPU_IMEM', b'READ '): cpu_imem_reads,
+    (b'CPU_DMEM', b'WRITE'): cpu_dmem_writes,
+    (b'CPU_DMEM', b'READ '): cpu_dmem_reads,
+    (b'AXI_MEM', b'WRITE'): axi_writes,
+    (b'AXI_MEM', b'READ '): axi_reads,
+}
 
 # Accept log file from command line or use default
 log_file = sys.argv[1] if len(sys.argv) > 1 else 'build/mem_trace.txt'
 
 try:
-    with open(log_file, 'r', errors='ignore') as f:
-        for line in f:
-            # Parse CPU IMEM reads
-            m = re.match(r'\[CPU_IMEM READ \] addr=0x([0-9a-f]+) data=0x([0-9a-f]+)', line)
-            if m:
-                addr, data = m.groups()
-                cpu_imem_reads.append((addr, data))
-                continue
-                
-            # Parse CPU DMEM transactions
-            m = re.match(r'\[CPU_DMEM (WRITE|READ )\] addr=0x([0-9a-f]+) data=0x([0-9a-f]+)', line)
-            if m:
-                op, addr, data = m.groups()
-                if 'WRITE' in op:
-                    cpu_dmem_writes.append((addr, data))
-                else:
-                    cpu_dmem_reads.append((addr, data))
-                continue
-                    
-            # Parse AXI MEM transactions
-            m = re.match(r'\[AXI_MEM (WRITE|READ )\] addr=0x([0-9a-f]+) data=0x([0-9a-f]+)', line)
-            if m:
-                op, addr, data = m.groups()
-                if 'WRITE' in op:
-                    axi_writes.append((addr, data))
-                else:
-                    axi_reads.append((addr, data))
+    with open(log_file, 'rb', buffering=1 << 20) as f:
+        st = os.fstat(f.fileno())
+        if not stat.S_ISREG(st.st_mode):
+            # Pipes and other special files cannot be mapped; read them whole
+            log = f.read()
+        elif st.st_size > 0:
+            log = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                log.madvise(mmap.MADV_SEQUENTIAL)
+        else:
+            # mmap cannot map an empty file
+            log = b''
 except FileNotFoundError:
     print(f"Error: {log_file} not found. Run 'make memtrace' first.")
     sys.exit(1)
 
-print("=" * 70)
-print("MEMORY TRACE VERIFICATION")
-print("=" * 70)
-print()
-print("Transaction Counts:")
-print(f"  CPU_IMEM READS:  {len(cpu_imem_reads):5d}")
-print(f"  CPU_DMEM WRITES: {len(cpu_dmem_writes):5d}")
-print(f"  CPU_DMEM READS:  {len(cpu_dmem_reads):5d}")
-print(f"  AXI_MEM WRITES:  {len(axi_writes):5d}")
-print(f"  AXI_MEM READS:   {len(axi_reads):5d}")
-print()
-
-# Create dictionaries for fast lookup
-axi_read_dict = {}
-for addr, data in axi_reads:
-    if addr not in axi_read_dict:
-        axi_read_dict[addr] = []
-    axi_read_dict[addr].append(data)
-
-axi_write_dict = {}
-for addr, data in axi_writes:
-    if addr not in axi_write_dict:
-        axi_write_dict[addr] = []
-    axi_write_dict[addr].append(data)
+for m in MEM_TRACE_RE.finditer(log):
+    iface, op, addr, data = m.groups()
+    target = targets.get((iface, op))
+    if target is not None:
+        target.append(_hex(addr) << 32 | _hex(data))
+
+report("=" * 70)
+report("MEMORY TRACE VERIFICATION")
+report("=" * 70)
+report()
+report("Transaction Counts:")
+report(f"  CPU_IMEM READS:  {len(cpu_imem_reads):5d}")
+report(f"  CPU_DMEM WRITES: {len(cpu_dmem_writes):5d}")
+report(f"  CPU_DMEM READS:  {len(cpu_dmem_reads):5d}")
+report(f"  AXI_MEM WRITES:  {len(axi_writes):5d}")
+report(f"  AXI_MEM READS:   {len(axi_reads):5d}")
+report()
+
+# Multisets of (addr, data) transactions; matching a CPU transaction against
+# AXI is a multiset intersection, and the AXI leftovers are the difference
+axi_read_counts = tally(axi_reads)
+axi_write_counts = tally(axi_writes)
 
 # Verify instruction fetches
-print("-" * 70)
-print("INSTRUCTION FETCH VERIFICATION (CPU_IMEM vs AXI_MEM)")
-print("-" * 70)
-imem_matches = 0
-imem_excess_axi = 0
-for addr, data in cpu_imem_reads:
-    if addr in axi_read_dict and data in axi_read_dict[addr]:
-        imem_matches += 1
-        axi_read_dict[addr].remove(data)
+report("-" * 70)
+report("INSTRUCTION FETCH VERIFICATION (CPU_IMEM vs AXI_MEM)")
+report("-" * 70)
+imem_matches = common_count(tally(cpu_imem_reads), axi_read_counts)
 
 # Count excess AXI reads (fetches that were discarded due to flushes)
-for addr in axi_read_dict:
-    imem_excess_axi += len(axi_read_dict[addr])
+imem_excess_axi = len(axi_reads) - imem_matches
 
-print(f"Matched:    {imem_matches}/{len(cpu_imem_reads)}")
-print(f"Mismatched: {len(cpu_imem_reads) - imem_matches}")
+report(f"Matched:    {imem_matches}/{len(cpu_imem_reads)}")
+report(f"Mismatched: {len(cpu_imem_reads) - imem_matches}")
 if imem_excess_axi > 0:
-    print(f"Note:       {imem_excess_axi} AXI fetch(es) discarded by CPU (pipeline flushes)")
+    report(f"Note:       {imem_excess_axi} AXI fetch(es) discarded by CPU (pipeline flushes)")
 if imem_matches == len(cpu_imem_reads):
-    print("Status:     PASS - All instruction fetches match!")
+    report("Status:     PASS - All instruction fetches match!")
 else:
     # Instruction mismatches are warnings, not failures (expected with pipeline flushes)
-    print("Status:     WARNING - Some CPU fetches don't match AXI (check for errors)")
-print()
+    report("Status:     WARNING - Some CPU fetches don't match AXI (check for errors)")
+report()
 
 # Verify data reads
-print("-" * 70)
-print("DATA READ VERIFICATION (CPU_DMEM vs AXI_MEM)")
-print("-" * 70)
-axi_read_dict = {}
-for addr, data in axi_reads:
-    if addr not in axi_read_dict:
-        axi_read_dict[addr] = []
-    axi_read_dict[addr].append(data)
-
-dmem_read_matches = 0
-for addr, data in cpu_dmem_reads:
-    if addr in axi_read_dict and data in axi_read_dict[addr]:
-        dmem_read_matches += 1
-        axi_read_dict[addr].remove(data)
-
-print(f"Matched:    {dmem_read_matches}/{len(cpu_dmem_reads)}")
-print(f"Mismatched: {len(cpu_dmem_reads) - dmem_read_matches}")
+report("-" * 70)
+report("DATA READ VERIFICATION (CPU_DMEM vs AXI_MEM)")
+report("-" * 70)
+dmem_read_matches = common_count(tally(cpu_dmem_reads), axi_read_counts)
+
+report(f"Matched:    {dmem_read_matches}/{len(cpu_dmem_reads)}")
+report(f"Mismatched: {len(cpu_dmem_reads) - dmem_read_matches}")
 if dmem_read_matches == len(cpu_dmem_reads):
-    print("Status:     PASS - All data reads match!")
+    report("Status:     PASS - All data reads match!")
 else:
-    print("Status:     FAIL - Mismatches detected")
-print()
+    report("Status:     FAIL - Mismatches detected")
+report()
 
 # Verify data writes
-print("-" * 70)
-print("DATA WRITE VERIFICATION (CPU_DMEM vs AXI_MEM)")
-print("-" * 70)
-magic_addrs = ['fffffff4', 'fffffff0']
-cpu_dmem_writes_mem = [(a, d) for a, d in cpu_dmem_writes if a not in magic_addrs]
-
-dmem_write_matches = 0
-for addr, data in cpu_dmem_writes_mem:
-    if addr in axi_write_dict and data in axi_write_dict[addr]:
-        dmem_write_matches += 1
-        axi_write_dict[addr].remove(data)
-
-console_writes = len([1 for a, d in cpu_dmem_writes if a == 'fffffff4'])
-exit_writes = len([1 for a, d in cpu_dmem_writes if a == 'fffffff0'])
-
-print(f"Matched:          {dmem_write_matches}/{len(cpu_dmem_writes_mem)}")
-print(f"Mismatched:       {len(cpu_dmem_writes_mem) - dmem_write_matches}")
-print(f"Console writes:   {console_writes} (magic addr, not in AXI)")
-print(f"Exit writes:      {exit_writes} (magic addr, not in AXI)")
+report("-" * 70)
+report("DATA WRITE VERIFICATION (CPU_DMEM vs AXI_MEM)")
+report("-" * 70)
+console_addr = 0xfffffff4
+exit_addr = 0xfffffff0
+
+# Split magic-address writes (handled at SoC level) from memory writes in one pass
+cpu_dmem_writes_mem = array('Q')
+magic_writes = Counter()
+for key in cpu_dmem_writes:
+    addr = key >> 32
+    if addr == console_addr or addr == exit_addr:
+        magic_writes[addr] += 1
+    else:
+        cpu_dmem_writes_mem.append(key)
+
+dmem_write_matches = common_count(tally(cpu_dmem_writes_mem), axi_write_counts)
+
+console_writes = magic_writes[console_addr]
+exit_writes = magic_writes[exit_addr]
+
+report(f"Matched:          {dmem_write_matches}/{len(cpu_dmem_writes_mem)}")
+report(f"Mismatched:       {len(cpu_dmem_writes_mem) - dmem_write_matches}")
+report(f"Console writes:   {console_writes} (magic addr, not in AXI)")
+report(f"Exit writes:      {exit_writes} (magic addr, not in AXI)")
 if dmem_write_matches == len(cpu_dmem_writes_mem):
-    print("Status:           PASS - All data writes match!")
+    report("Status:           PASS - All data writes match!")
 else:
-    print("Status:           FAIL - Mismatches detected")
-print()
+    report("Status:           FAIL - Mismatches detected")
+report()
 
 # Overall summary
-print("=" * 70)
-print("OVERALL SUMMARY")
-print("=" * 70)
+report("=" * 70)
+report("OVERALL SUMMARY")
+report("=" * 70)
 
 # Only fail on data read/write mismatches; instruction mismatches are warnings
 data_pass = (
@@ -159,27 +186,29 @@ data_pass = (
 imem_pass = imem_matches == len(cpu_imem_reads)
 
 if data_pass:
-    print("RESULT: PASS - Data memory interface verified")
-    print()
-    print("Details:")
-    print(f"  - {len(cpu_imem_reads)} instruction fetches ({imem_matches} matched, {len(cpu_imem_reads) - imem_matches} mismatched)")
+    report("RESULT: PASS - Data memory interface verified")
+    report()
+    report("Details:")
+    report(f"  - {len(cpu_imem_reads)} instruction fetches ({imem_matches} matched, {len(cpu_imem_reads) - imem_matches} mismatched)")
     if imem_excess_axi > 0:
-        print(f"    Note: {imem_excess_axi} AXI instruction fetch(es) discarded due to pipeline flushes")
-        print(f"          (branches/interrupts/exceptions - this is correct behavior)")
-    print(f"  - {len(cpu_dmem_reads)} data reads verified")
-    print(f"  - {len(cpu_dmem_writes_mem)} data writes verified")
-    print(f"  - {console_writes} console writes (handled at SoC level)")
-    print(f"  - {exit_writes} exit write (program termination)")
+        report(f"    Note: {imem_excess_axi} AXI instruction fetch(es) discarded due to pipeline flushes")
+        report(f"          (branches/interrupts/exceptions - this is correct behavior)")
+    report(f"  - {len(cpu_dmem_reads)} data reads verified")
+    report(f"  - {len(cpu_dmem_writes_mem)} data writes verified")
+    report(f"  - {console_writes} console writes (handled at SoC level)")
+    report(f"  - {exit_writes} exit write (program termination)")
     if not imem_pass:
-        print()
-        print("WARNING: Some instruction fetch mismatches detected.")
-        print("         This is typically expected due to pipeline flushes.")
-        print("         Check for actual errors in data memory transactions above.")
-    sys.exit(0)
+        report()
+        report("WARNING: Some instruction fetch mismatches detected.")
+        report("         This is typically expected due to pipeline flushes.")
+        report("         Check for actual errors in data memory transactions above.")
+    exit_code = 0
 else:
-    print("RESULT: FAIL - Data memory inconsistencies detected")
-    print(f"  Instruction fetch mismatches: {len(cpu_imem_reads) - imem_matches} (warning only)")
-    print(f"  Data read issues: {len(cpu_dmem_reads) - dmem_read_matches}")
-    print(f"  Data write issues: {len(cpu_dmem_writes_mem) - dmem_write_matches}")
-    sys.exit(1)
-print("=" * 70)
+    report("RESULT: FAIL - Data memory inconsistencies detected")
+    report(f"  Instruction fetch mismatches: {len(cpu_imem_reads) - imem_matches} (warning only)")
+    report(f"  Data read issues: {len(cpu_dmem_reads) - dmem_read_matches}")
+    report(f"  Data write issues: {len(cpu_dmem_writes_mem) - dmem_write_matches}")
+    exit_code = 1
+
+sys.stdout.writelines(report_lines)
+sys.exit(exit_code)
@@ -3,317 +3,391 @@
 Parse RTL trace and generate call trace with function names
 """
 
+import os
 import sys
 import re
+import heapq
+import pickle
 import subprocess
+from array import array
+from bisect import bisect_right
 from pathlib import Path
 from collections import defaultdict
+from itertools import chain
 
 # Configuration: Maximum number of trace entries to display in output files
 # Increase this value if you need to see more trace entries
+# (the cap is applied while parsing, so entries past it are never stored)
 MAX_TRACE_ENTRIES = 5000
 
+# Symbols and stack frame sizes are cached across runs in <elf_file>.symcache
+SYMCACHE_SUFFIX = '.symcache'
+
+# Normal RAM range; PCs outside it are reported as invalid
+RAM_START = 0x80000000
+RAM_END = 0x80040000
+# Number of distinct invalid PCs kept as examples for the report
+MAX_INVALID_PC_EXAMPLES = 10
+
+# Read buffer size for trace files (the 8 KiB default means many small reads)
+TRACE_BUFFER_SIZE = 1 << 20
+
+# nm symbol types that mark functions (text and weak symbols)
+FUNC_SYMBOL_TYPES = frozenset(['T', 't', 'W', 'w'])
+
+# Trace line patterns, matched against raw bytes; group 1 is the PC and the
+# optional group 2 the instruction word
+# RTL format: "cycle_num 0xPC (0xINSTR) ..."
+RTL_LINE_RE = re.compile(
+    rb'\s*\S+\s+0x([0-9a-fA-F]+)(?!\S)(?:\s+\(0x([0-9a-fA-F]+)\)(?!\S))?')
+# Spike format: "core   0: privilege 0xPC (0xINSTR) ..."
+SPIKE_LINE_RE = re.compile(
+    rb'\s*core\s+\S+\s+\S+\s+(?:0[xX])?([0-9a-fA-F]+)(?!\S)(?:\s+\(0x([0-9a-fA-F]+)\)(?!\S))?')
+# Call target in a disassembly comment: "jal ra,80000140 <foo>"
+CALL_TARGET_RE = re.compile(rb'<([^>]+)>')
+# Call/return mnemonic in a disassembly comment, found in one scan
+CALL_RET_RE = re.compile(rb'; (jalr|jal |ret)')
+
+# objdump -d function label ("80000140 <foo>:") and prologue stack allocation
+FUNC_LABEL_RE = re.compile(r'<(.*)>:')
+STACK_ALLOC_RE = re.compile(r'addi\s+sp,sp,(-\d+)')
+
+# Instruction word encodings, tested with one mask each
+# Calls: JAL (opcode 0x6F) or JALR (opcode 0x67) with rd = x1 (bits 11:7)
+CALL_MASK = 0xFFF
+JAL_RA = (1 << 7) | 0x6F
+JALR_RA = (1 << 7) | 0x67
+# Returns: JALR x0, offset(x1) - rd = x0, rs1 = x1 (bits 19:15)
+RET_MASK = 0xF8FFF
+JALR_X0_RA = (1 << 15) | 0x67
+
 def get_symbols_from_elf(elf_file, toolchain_prefix):
-    """Extract symbol table from ELF file using nm"""
+    """Extract function symbols from ELF file using nm
+
+    Returns (addrs, names): an array('Q') of function addresses and the
+    parallel list of their names, sorted by address for bisect. Returns None
+    if nm failed or listed no symbols at all.
+    """
     print(f"Extracting symbols from {elf_file}...")
     
-    nm_cmd = f"{toolchain_prefix}nm -n {elf_file}"
+    nm_cmd = [f"{toolchain_prefix}nm", "-n", elf_file]
+    num_symbols = 0
+    funcs = []
     try:
-        result = subprocess.run(nm_cmd, shell=True, capture_output=True, text=True, check=True)
-    except subprocess.CalledProcessError as e:
+        # Parse nm output as it is produced instead of buffering all of it
+        with subprocess.Popen(nm_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              text=True, bufsize=1 << 20) as proc:
+            for line in proc.stdout:
+                parts = line.split()
+                if len(parts) >= 3:
+                    num_symbols += 1
+                    # Only text (T/t) and weak (W/w) symbols are functions
+                    if parts[1] in FUNC_SYMBOL_TYPES:
+                        funcs.append((int(parts[0], 16), ' '.join(parts[2:])))
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, nm_cmd)
+    except (OSError, subprocess.CalledProcessError) as e:
         print(f"Error running nm: {e}")
-        return []
-    
-    symbols = []
-    for line in result.stdout.splitlines():
-        parts = line.split()
-        if len(parts) >= 3:
-            addr = int(parts[0], 16)
-            sym_type = parts[1]
-            name = ' '.join(parts[2:])
-            symbols.append((addr, name, sym_type))
-    
-    print(f"Found {len(symbols)} symbols")
-    return symbols
+        return None
+    
+    # Stable sort: when symbols share an address, the first one listed wins
+    funcs.sort(key=lambda sym: sym[0])
+    addrs = array('Q')
+    names = []
+    for addr, name in funcs:
+        if addrs and addrs[-1] == addr:
+            continue
+        addrs.append(addr)
+        names.append(name)
+    
+    print(f"Found {num_symbols} symbols")
+    if num_symbols == 0:
+        return None
+    return addrs, names
 
 def addr_to_symbol(addr, symbols):
     """Find the function name for a given address"""
-    if not symbols:
+    addrs, names = symbols
+    
+    # Binary search for the symbol with the highest address <= addr
+    i = bisect_right(addrs, addr) - 1
+    if i < 0:
         return None
     
-    # Find the symbol with the highest address <= addr
-    best_match = None
-    best_addr = 0
-    
-    for sym_addr, name, sym_type in symbols:
-        if sym_addr <= addr and sym_addr > best_addr:
-            # Only consider text (T/t) symbols for functions
-            if sym_type in ['T', 't', 'W', 'w']:
-                best_match = name
-                best_addr = sym_addr
-    
-    if best_match:
-        offset = addr - best_addr
-        if offset > 0:
-            return f"{best_match}+0x{offset:x}"
-        else:
-            return best_match
-    
-    return None
+    offset = addr - addrs[i]
+    if offset > 0:
+        return f"{names[i]}+0x{offset:x}"
+    return names[i]
 
-def parse_rtl_trace(trace_file, symbols):
-    """Parse RTL trace and generate call trace"""
-    print(f"Parsing {trace_file}...")
-    
-    current_func = None
-    func_call_count = defaultdict(int)
-    call_trace = []
-    pc_history = []
-    
-    # Detect trace format by reading first non-empty line
-    trace_format = 'rtl'  # default
-    with open(trace_file, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                if line.startswith('core'):
-                    trace_format = 'spike'
-                    print(f"Detected Spike trace format")
-                else:
-                    print(f"Detected RTL trace format")
-                break
+def symbol_resolver(symbols):
+    """Memoized PC lookup returning (func_name, base_func), or (None, None)
+
+    Traces revisit the same PCs constantly, so each PC is resolved and its
+    name formatted and split only once.
+    """
+    cache = {}
     
-    with open(trace_file, 'r') as f:
-        for line_num, line in enumerate(f, 1):
-            parts = line.strip().split()
-            if len(parts) < 2:
-                continue
-            
-            # Parse based on format
-            # RTL format: "cycle_num 0xPC (0xINSTR) ..."
-            # Spike format: "core   0: privilege 0xPC (0xINSTR) ..."
-            pc = None
-            if trace_format == 'spike':
-                # Spike format: PC is at index 3 (after "core 0: privilege")
-                if len(parts) >= 4 and parts[0] == 'core':
-                    try:
-                        pc = int(parts[3], 16)
-                    except (ValueError, IndexError):
-                        continue
-            else:
-                # RTL format: PC is at index 1
-                if parts[1].startswith('0x'):
-                    try:
-                        pc = int(parts[1], 16)
-                    except ValueError:
-                        continue
-            
-            if pc is None:
-                continue
-            
-            pc_history.append(pc)
-            
-            # Find function name for this PC
+    def resolve(pc):
+        hit = cache.get(pc)
+        if hit is None:
             func_name = addr_to_symbol(pc, symbols)
-            
-            if func_name:
-                # Extract base function name (without offset)
-                base_func = func_name.split('+')[0]
-                
-                # Check if we entered a new function
-                if current_func != base_func:
-                    func_call_count[base_func] += 1
-                    call_trace.append({
-                        'line': line_num,
-                        'pc': pc,
-                        'function': func_name,
-                        'count': func_call_count[base_func]
-                    })
-                    current_func = base_func
-            
-            # Show progress every 10000 lines
-            if line_num % 10000 == 0:
-                print(f"Processed {line_num} lines...")
+            # Base function name (without offset), interned so that every
+            # PC inside a function shares one string object
+            base_func = sys.intern(func_name.split('+')[0]) if func_name else None
+            hit = cache[pc] = (func_name, base_func)
+        return hit
     
-    print(f"Total lines processed: {line_num}")
-    return call_trace, func_call_count, pc_history
+    return resolve
 
-def get_stack_frame_size(elf_file, toolchain_prefix, func_name):
-    """Get stack frame size for a function by analyzing its prologue"""
+def build_stack_size_table(elf_file, toolchain_prefix):
+    """Get stack frame sizes for all functions by analyzing their prologues
+
+    Runs objdump once and returns {function: size}; the size is None for
+    functions whose prologue has no "addi sp,sp,-XXX". Returns None if
+    objdump could not be run or failed.
+    """
+    stack_sizes = {}
     try:
-        # Use objdump to get disassembly
-        objdump_cmd = f"{toolchain_prefix}objdump -d {elf_file}"
-        result = subprocess.run(objdump_cmd, shell=True, capture_output=True, text=True, check=True)
+        # Stream the disassembly instead of buffering all of it
+        objdump_cmd = [f"{toolchain_prefix}objdump", "-d", elf_file]
+        with subprocess.Popen(objdump_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              text=True, bufsize=1 << 20) as proc:
+            current_func = None
+            for line in proc.stdout:
+                # A function label starts the next function
+                if '<' in line and '>:' in line:
+                    label = FUNC_LABEL_RE.search(line)
+                    name = label.group(1) if label else None
+                    if name == current_func:
+                        # Repeated label of the function being scanned
+                        continue
+                    # Only the first definition of a name counts
+                    if name is None or name in stack_sizes:
+                        current_func = None
+                    else:
+                        stack_sizes[name] = None
+                        current_func = name
+                    continue
+                
+                if current_func is not None:
+                    # Look for stack allocation: addi sp,sp,-XXX
+                    match = STACK_ALLOC_RE.search(line)
+                    if match:
+                        stack_sizes[current_func] = abs(int(match.group(1)))
+                        current_func = None
         
-        # Find function and look for "addi sp,sp,-XXX" in prologue
-        in_function = False
-        for line in result.stdout.splitlines():
-            if f"<{func_name}>:" in line:
-                in_function = True
-                continue
-            
-            if in_function:
-                # Look for stack allocation: addi sp,sp,-XXX
-                match = re.search(r'addi\s+sp,sp,(-\d+)', line)
-                if match:
-                    return abs(int(match.group(1)))
-                # Stop at next function or after a few instructions
-                if line.strip() and '<' in line and '>:' in line:
-                    break
-    except:
+        if proc.returncode != 0:
+            # Output of a failed objdump is not trusted
+            return None
+    except (OSError, UnicodeDecodeError, subprocess.SubprocessError):
+        return None
+    return stack_sizes
+
+def load_elf_tables(elf_file, toolchain_prefix):
+    """Symbols and stack frame sizes of an ELF, cached next to it across runs
+
+    The cache is keyed on the ELF size, modification time and toolchain
+    prefix, and is rebuilt with nm/objdump whenever any of them changes.
+    """
+    cache_file = elf_file + SYMCACHE_SUFFIX
+    st = os.stat(elf_file)
+    key = (st.st_size, st.st_mtime_ns, toolchain_prefix)
+    try:
+        with open(cache_file, 'rb') as f:
+            cached = pickle.load(f)
+        if cached['key'] == key:
+            print(f"Loaded {len(cached['symbols'][0])} function symbols from {cache_file}")
+            return cached['symbols'], cached['stack_sizes']
+    except Exception:
+        # Missing, stale-format or corrupt cache: rebuild it
         pass
-    return None
+    
+    symbols = get_symbols_from_elf(elf_file, toolchain_prefix)
+    if symbols is None:
+        return None, {}
+    
+    # Disassemble once for the stack frame sizes of all functions
+    stack_sizes = build_stack_size_table(elf_file, toolchain_prefix)
+    if stack_sizes is None:
+        # Run without frame sizes, and retry objdump next time
+        return symbols, {}
+    try:
+        with open(cache_file, 'wb') as f:
+            pickle.dump({'key': key, 'symbols': symbols, 'stack_sizes': stack_sizes}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+    except OSError:
+        # Read-only build directory: run uncached
+        pass
+    return symbols, stack_sizes
+
+def parse_rtl_trace_unified(trace_file, resolve, stack_sizes):
+    """Parse RTL trace once, collecting both the call trace and the call tree
 
-def parse_rtl_trace_tree(trace_file, symbols, elf_file, toolchain_prefix):
-    """Parse RTL trace and build call tree with stack tracking"""
-    print(f"Parsing {trace_file} for tree structure...")
+    Returns (call_trace, func_call_count, pc_stats, tree_output,
+    stack_size_cache, counts). call_trace holds one (line, pc, function,
+    count) tuple per function transition and tree_output one (line, entry pc,
+    depth, text) tuple per call tree node. pc_stats summarizes every traced
+    PC: the set of 'unique' PCs, the 'invalid_count' of entries outside
+    RAM and the first distinct 'invalid' PCs, in trace order. call_trace
+    and tree_output are capped at MAX_TRACE_ENTRIES while parsing; counts
+    holds their full sizes ('transitions', 'tree_entries') and the deepest
+    tree level ('max_depth', -1 for an empty tree).
+    """
+    print(f"Parsing {trace_file}...")
+    
+    # Function transitions
+    current_func = None
+    func_call_count = defaultdict(int)
+    call_trace = []
+    num_transitions = 0
+    unique_pcs = set()
+    num_invalid_pcs = 0
+    invalid_pcs = []
     
+    # Call tree with stack tracking
     call_stack = []
     tree_output = []
-    prev_pc = None
+    num_tree_entries = 0
+    max_depth = -1
     
     # Cache for stack sizes
     stack_size_cache = {}
     
     # Track which functions we've already added to tree to avoid duplicates
+    # Calls are grouped by line number ranges (line // 100), which only ever
+    # grow, so the set holds the current range alone and is cleared when the
+    # next one starts. Keys pack (depth, function id) into one int: no tuple
+    # per call, and hashing an int is cheaper than hashing a tuple with a string
     seen_calls = set()
+    seen_range = -1
+    func_ids = {}
     
-    # Detect trace format by reading first non-empty line
-    trace_format = 'rtl'  # default
-    with open(trace_file, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line:
-                if line.startswith('core'):
-                    trace_format = 'spike'
+    line_num = 0
+    with open(trace_file, 'rb', buffering=TRACE_BUFFER_SIZE) as f:
+        lines = enumerate(f, 1)
+        
+        # Detect trace format from the first non-empty line, then run the
+        # main loop with the matching line pattern bound once
+        is_spike = False
+        line_re = RTL_LINE_RE
+        for line_num, line in lines:
+            stripped = line.strip()
+            if stripped:
+                is_spike = stripped.startswith(b'core')
+                if is_spike:
+                    line_re = SPIKE_LINE_RE
                     print(f"Detected Spike trace format")
                 else:
                     print(f"Detected RTL trace format")
+                lines = chain([(line_num, line)], lines)
                 break
-    
-    with open(trace_file, 'r') as f:
-        for line_num, line in enumerate(f, 1):
-            parts = line.strip().split()
-            if len(parts) < 2:
+        
+        for line_num, line in lines:
+            m = line_re.match(line)
+            if m is None:
                 continue
             
-            # Parse based on format
-            # RTL format: "cycle_num 0xPC (0xINSTR) ..."
-            # Spike format: "core   0: privilege 0xPC (0xINSTR) ..."
-            pc = None
-            if trace_format == 'spike':
-                # Spike format: PC is at index 3 (after "core 0: privilege")
-                if len(parts) >= 4 and parts[0] == 'core':
-                    try:
-                        pc = int(parts[3], 16)
-                    except (ValueError, IndexError):
-                        continue
-            else:
-                # RTL format: PC is at index 1
-                if parts[1].startswith('0x'):
-                    try:
-                        pc = int(parts[1], 16)
-                    except ValueError:
-                        continue
-            
-            if pc is None:
-                continue
+            pc = int(m.group(1), 16)
+            unique_pcs.add(pc)
+            if pc < RAM_START or pc > RAM_END:
+                num_invalid_pcs += 1
+                if len(invalid_pcs) < MAX_INVALID_PC_EXAMPLES and pc not in invalid_pcs:
+                    invalid_pcs.append(pc)
             
             # Extract instruction opcode
-            instr = None
-            instr_idx = 4 if trace_format == 'spike' else 2
-            if len(parts) > instr_idx and parts[instr_idx].startswith('(0x') and parts[instr_idx].endswith(')'):
-                try:
-                    instr = int(parts[instr_idx][3:-1], 16)
-                except ValueError:
-                    pass
+            instr = m.group(2)
+            if instr is not None:
+                instr = int(instr, 16)
             
             # Check instruction type from disassembly comment (RTL) or decode instruction (Spike)
-            line_lower = line.lower()
+            # Disassembly comments are lowercase, so the raw line is matched directly
+            comment = CALL_RET_RE.search(line)
+            mnemonic = comment.group(1) if comment else None
             
             # Detect function calls (jal/jalr that saves return address)
             is_call = False
             rd = None  # destination register
             
             # Try to get rd from trace (RTL format has "x1  0x..." for register writes)
-            if ' x1 ' in line or ' x1  ' in line:
+            if b' x1 ' in line:
                 rd = 1
             
             # Check from comments (RTL traces)
-            if '; jal ' in line_lower and rd == 1:
-                is_call = True
-            elif '; jalr' in line_lower and rd == 1:
+            if rd == 1 and (mnemonic == b'jal ' or mnemonic == b'jalr'):
                 is_call = True
             # Decode instruction (for Spike traces without comments)
             elif instr is not None:
-                opcode = instr & 0x7F
-                rd = (instr >> 7) & 0x1F
-                # JAL opcode = 0x6F, JALR opcode = 0x67
-                if (opcode == 0x6F or opcode == 0x67) and rd == 1:
+                low = instr & CALL_MASK
+                if low == JAL_RA or low == JALR_RA:
                     is_call = True
             
             # Detect returns (ret or jalr with specific patterns)
             is_return = False
-            if '; ret' in line_lower:
+            if mnemonic == b'ret':
                 is_return = True
-            elif '; jalr' in line_lower and 'x0' in line_lower:
+            elif mnemonic == b'jalr' and b'x0' in line:
                 is_return = True
             # Decode instruction for returns (jalr x0, offset(x1))
             elif instr is not None:
-                opcode = instr & 0x7F
-                rd = (instr >> 7) & 0x1F
-                rs1 = (instr >> 15) & 0x1F
                 # JALR x0, offset(x1) - typical return pattern
-                if opcode == 0x67 and rd == 0 and rs1 == 1:
+                if instr & RET_MASK == JALR_X0_RA:
                     is_return = True
             
             # Find function name for this PC
-            func_name = addr_to_symbol(pc, symbols)
+            func_name, base_func = resolve(pc)
+            
+            # Check if we entered a new function
+            if func_name and current_func != base_func:
+                func_call_count[base_func] += 1
+                num_transitions += 1
+                if num_transitions <= MAX_TRACE_ENTRIES:
+                    call_trace.append((line_num, pc, func_name, func_call_count[base_func]))
+                current_func = base_func
             
             # Check if we have a pending call to resolve
             if call_stack and call_stack[-1].get('pending'):
                 pending_call = call_stack[-1]
                 if func_name:
-                    target_func = func_name.split('+')[0]
+                    target_func = base_func
                     pending_call['name'] = target_func
                     pending_call['pending'] = False
                     
                     # Get stack size
                     if target_func not in stack_size_cache:
-                        stack_size_cache[target_func] = get_stack_frame_size(elf_file, toolchain_prefix, target_func)
+                        stack_size_cache[target_func] = stack_sizes.get(target_func)
                     pending_call['stack_size'] = stack_size_cache[target_func]
                     
                     # Add to tree output
-                    call_key = (len(call_stack) - 1, target_func, pending_call['line'] // 100)
+                    func_id = func_ids.setdefault(target_func, len(func_ids))
+                    if pending_call['line'] // 100 != seen_range:
+                        seen_range = pending_call['line'] // 100
+                        seen_calls.clear()
+                    call_key = (len(call_stack) - 1) << 32 | func_id
                     if call_key not in seen_calls:
                         seen_calls.add(call_key)
-                        indent = "  " * (len(call_stack) - 1)
-                        stack_info = f" [frame: {pending_call['stack_size']} bytes]" if pending_call['stack_size'] else ""
-                        tree_output.append({
-                            'line': pending_call['line'],
-                            'pc': pending_call['entry_pc'],
-                            'indent': indent,
-                            'text': f"{target_func}{stack_info}",
-                            'depth': len(call_stack) - 1
-                        })
+                        depth = len(call_stack) - 1
+                        num_tree_entries += 1
+                        max_depth = max(max_depth, depth)
+                        if num_tree_entries <= MAX_TRACE_ENTRIES:
+                            stack_info = f" [frame: {pending_call['stack_size']} bytes]" if pending_call['stack_size'] else ""
+                            tree_output.append((pending_call['line'], pending_call['entry_pc'], depth,
+                                                f"{target_func}{stack_info}"))
             
             if func_name:
-                base_func = func_name.split('+')[0]
-                
                 # On function call, push to stack
                 if is_call:
                     # Find the target function being called
                     # Method 1: Look for target address in disassembly comment (RTL traces)
-                    target_match = re.search(r'<([^>]+)>', line)
+                    target_match = CALL_TARGET_RE.search(line)
                     target_func = None
                     
                     if target_match:
-                        target_func = target_match.group(1)
+                        target_func = sys.intern(target_match.group(1).decode())
                     
                     # Method 2: For Spike traces without comments, we'll detect the call
                     # and the next instruction's function will be the target
                     # Store this as a pending call that will be resolved on next iteration
-                    if not target_func and trace_format == 'spike':
+                    if not target_func and is_spike:
                         # Mark that we just made a call, target will be determined by next PC
                         call_stack.append({
                             'name': None,  # Will be filled on next iteration
@@ -326,12 +400,16 @@ def parse_rtl_trace_tree(trace_file, symbols, elf_file, toolchain_prefix):
                         
                         # Get stack size if not cached
                         if target_func not in stack_size_cache:
-                            stack_size_cache[target_func] = get_stack_frame_size(elf_file, toolchain_prefix, target_func)
+                            stack_size_cache[target_func] = stack_sizes.get(target_func)
                         
                         stack_size = stack_size_cache[target_func]
                         
                         # Create unique key for this call to avoid exact duplicates
-                        call_key = (len(call_stack), target_func, line_num // 100)  # Group by line number ranges
+                        func_id = func_ids.setdefault(target_func, len(func_ids))
+                        if line_num // 100 != seen_range:
+                            seen_range = line_num // 100
+                            seen_calls.clear()
+                        call_key = len(call_stack) << 32 | func_id
                         
                         if call_key not in seen_calls:
                             seen_calls.add(call_key)
@@ -343,105 +421,124 @@ def parse_rtl_trace_tree(trace_file, symbols, elf_file, toolchain_prefix):
                                 'stack_size': stack_size
                             })
                             
-                            indent = "  " * (len(call_stack) - 1)
-                            stack_info = f" [frame: {stack_size} bytes]" if stack_size else ""
-                            tree_output.append({
-                                'line': line_num,
-                                'pc': pc,
-                                'indent': indent,
-                                'text': f"{target_func}{stack_info}",
-                                'depth': len(call_stack) - 1
-                            })
+                            depth = len(call_stack) - 1
+                            num_tree_entries += 1
+                            max_depth = max(max_depth, depth)
+                            if num_tree_entries <= MAX_TRACE_ENTRIES:
+                                stack_info = f" [frame: {stack_size} bytes]" if stack_size else ""
+                                tree_output.append((line_num, pc, depth, f"{target_func}{stack_info}"))
                 
                 # On return, pop from stack
                 elif is_return and len(call_stack) > 0:
                     call_stack.pop()
             
-            prev_pc = pc
-            
             # Progress
             if line_num % 10000 == 0:
                 print(f"Processed {line_num} lines...")
     
     print(f"Total lines processed: {line_num}")
-    print(f"Call tree entries: {len(tree_output)}")
-    print(f"Maximum call depth: {max([e['depth'] for e in tree_output]) + 1 if tree_output else 0}")
-    return tree_output, stack_size_cache
+    print(f"Call tree entries: {num_tree_entries}")
+    print(f"Maximum call depth: {max_depth + 1}")
+    counts = {
+        'transitions': num_transitions,
+        'tree_entries': num_tree_entries,
+        'max_depth': max_depth,
+    }
+    pc_stats = {
+        'unique': unique_pcs,
+        'invalid_count': num_invalid_pcs,
+        'invalid': invalid_pcs,
+    }
+    return call_trace, func_call_count, pc_stats, tree_output, stack_size_cache, counts
+
+def generate_call_trace_report(output_file, call_trace, func_call_count, pc_stats, tree_output=None, stack_size_cache=None,
+                               counts=None):
+    """Generate detailed call trace report
 
-def generate_call_trace_report(output_file, call_trace, func_call_count, pc_history, tree_output=None, stack_size_cache=None):
-    """Generate detailed call trace report"""
+    counts gives the full sizes of call_trace and tree_output when they were
+    capped while parsing (see parse_rtl_trace_unified).
+    """
     print(f"Generating report to {output_file}...")
     
-    with open(output_file, 'w') as f:
-        f.write("=" * 80 + "\n")
-        f.write("RTL Call Trace Report\n")
-        f.write("=" * 80 + "\n\n")
+    if counts is None:
+        counts = {
+            'transitions': len(call_trace),
+            'tree_entries': len(tree_output) if tree_output else 0,
+            'max_depth': max([depth for _, _, depth, _ in tree_output]) if tree_output else -1,
+        }
+    
+    # Collect the report text and write it in one call
+    out = []
+    write = out.append
+    
+    write("=" * 80 + "\n")
+    write("RTL Call Trace Report\n")
+    write("=" * 80 + "\n\n")
+    
+    # Tree view if available
+    if tree_output:
+        write("Call Tree Structure:\n")
+        write("-" * 80 + "\n")
+        out.extend(f"{'  ' * depth}{text}\n" for _, _, depth, text in tree_output[:MAX_TRACE_ENTRIES])
+        
+        if counts['tree_entries'] > MAX_TRACE_ENTRIES:
+            write(f"\n... ({counts['tree_entries'] - MAX_TRACE_ENTRIES} more calls omitted for brevity)\n")
         
-        # Tree view if available
-        if tree_output:
-            f.write("Call Tree Structure:\n")
-            f.write("-" * 80 + "\n")
-            for entry in tree_output[:MAX_TRACE_ENTRIES]:
-                f.write(f"{entry['indent']}{entry['text']}\n")
+        # Stack usage summary
+        if stack_size_cache:
+            write("\n" + "=" * 80 + "\n")
+            write("Stack Frame Sizes:\n")
+            write("-" * 80 + "\n")
             
-            if len(tree_output) > MAX_TRACE_ENTRIES:
-                f.write(f"\n... ({len(tree_output) - MAX_TRACE_ENTRIES} more calls omitted for brevity)\n")
+            # nlargest keeps the order of sorted(..., reverse=True)[:n], ties included
+            top_stack = heapq.nlargest(30, ((k, v) for k, v in stack_size_cache.items() if v),
+                                       key=lambda x: x[1])
+            for func, size in top_stack:
+                write(f"  {size:4d} bytes  {func}\n")
             
-            # Stack usage summary
-            if stack_size_cache:
-                f.write("\n" + "=" * 80 + "\n")
-                f.write("Stack Frame Sizes:\n")
-                f.write("-" * 80 + "\n")
-                
-                sorted_stack = sorted([(k, v) for k, v in stack_size_cache.items() if v], 
-                                    key=lambda x: x[1], reverse=True)
-                for func, size in sorted_stack[:30]:
-                    f.write(f"  {size:4d} bytes  {func}\n")
-                
-                if sorted_stack:
-                    total_stack = sum([v for k, v in sorted_stack])
-                    max_depth = max([e['depth'] for e in tree_output]) if tree_output else 0
-                    f.write(f"\n  Total stack in traced functions: {total_stack} bytes\n")
-                    f.write(f"  Maximum call depth: {max_depth}\n")
-        
-        f.write("\n" + "=" * 80 + "\n")
-        f.write("Function Call Summary (by frequency):\n")
-        f.write("-" * 80 + "\n")
-        sorted_funcs = sorted(func_call_count.items(), key=lambda x: x[1], reverse=True)
-        for func, count in sorted_funcs[:50]:  # Top 50 most called
-            f.write(f"  {count:6d}x  {func}\n")
-        
-        f.write("\n" + "=" * 80 + "\n")
-        f.write("Detailed Call Trace (function transitions):\n")
-        f.write("=" * 80 + "\n\n")
-        
-        # Detailed trace
-        for entry in call_trace[:MAX_TRACE_ENTRIES]:
-            f.write(f"Line {entry['line']:8d}: PC=0x{entry['pc']:08x}  "
-                   f"=> {entry['function']}")
-            if entry['count'] > 1:
-                f.write(f"  [call #{entry['count']}]")
-            f.write("\n")
-        
-        if len(call_trace) > MAX_TRACE_ENTRIES:
-            f.write(f"\n... ({len(call_trace) - MAX_TRACE_ENTRIES} more transitions omitted)\n")
+            if top_stack:
+                total_stack = sum(v for v in stack_size_cache.values() if v)
+                write(f"\n  Total stack in traced functions: {total_stack} bytes\n")
+                write(f"  Maximum call depth: {counts['max_depth']}\n")
+    
+    write("\n" + "=" * 80 + "\n")
+    write("Function Call Summary (by frequency):\n")
+    write("-" * 80 + "\n")
+    top_funcs = heapq.nlargest(50, func_call_count.items(), key=lambda x: x[1])
+    for func, count in top_funcs:  # Top 50 most called
+        write(f"  {count:6d}x  {func}\n")
+    
+    write("\n" + "=" * 80 + "\n")
+    write("Detailed Call Trace (function transitions):\n")
+    write("=" * 80 + "\n\n")
+    
+    # Detailed trace
+    for line_num, pc, func_name, count in call_trace[:MAX_TRACE_ENTRIES]:
+        call_info = f"  [call #{count}]" if count > 1 else ""
+        write(f"Line {line_num:8d}: PC=0x{pc:08x}  => {func_name}{call_info}\n")
+    
+    if counts['transitions'] > MAX_TRACE_ENTRIES:
+        write(f"\n... ({counts['transitions'] - MAX_TRACE_ENTRIES} more transitions omitted)\n")
+    
+    # PC range summary
+    if pc_stats['unique']:
+        write("\n" + "=" * 80 + "\n")
+        write("PC Range Summary:\n")
+        write("-" * 80 + "\n")
+        write(f"  Min PC: 0x{min(pc_stats['unique']):08x}\n")
+        write(f"  Max PC: 0x{max(pc_stats['unique']):08x}\n")
+        write(f"  Total unique PCs: {len(pc_stats['unique'])}\n")
         
-        # PC range summary
-        if pc_history:
-            f.write("\n" + "=" * 80 + "\n")
-            f.write("PC Range Summary:\n")
-            f.write("-" * 80 + "\n")
-            f.write(f"  Min PC: 0x{min(pc_history):08x}\n")
-            f.write(f"  Max PC: 0x{max(pc_history):08x}\n")
-            f.write(f"  Total unique PCs: {len(set(pc_history))}\n")
-            
-            # Check for invalid PCs (outside normal RAM range)
-            invalid_pcs = [pc for pc in pc_history if pc < 0x80000000 or pc > 0x80040000]
-            if invalid_pcs:
-                f.write(f"\n  WARNING: Found {len(invalid_pcs)} PCs outside RAM range!\n")
-                f.write(f"  Invalid PC examples: ")
-                f.write(", ".join([f"0x{pc:08x}" for pc in list(set(invalid_pcs))[:10]]))
-                f.write("\n")
+        # Check for invalid PCs (outside normal RAM range)
+        if pc_stats['invalid_count']:
+            write(f"\n  WARNING: Found {pc_stats['invalid_count']} PCs outside RAM range!\n")
+            write(f"  Invalid PC examples: ")
+            write(", ".join([f"0x{pc:08x}" for pc in pc_stats['invalid']]))
+            write("\n")
+    
+    # Write the whole report at once
+    with open(output_file, 'w') as f:
+        f.writelines(out)
 
 def main():
     if len(sys.argv) < 4:
@@ -463,25 +560,27 @@ def main():
         print(f"Error: ELF file not found: {elf_file}")
         sys.exit(1)
     
-    # Extract symbols from ELF
-    symbols = get_symbols_from_elf(elf_file, toolchain_prefix)
-    if not symbols:
+    # Extract symbols and stack frame sizes from ELF
+    symbols, stack_sizes = load_elf_tables(elf_file, toolchain_prefix)
+    if symbols is None:
         print("Error: No symbols found in ELF file")
         sys.exit(1)
     
-    # Parse RTL trace for tree structure
-    tree_output, stack_size_cache = parse_rtl_trace_tree(trace_file, symbols, elf_file, toolchain_prefix)
+    # PC lookup cache
+    resolve = symbol_resolver(symbols)
     
-    # Parse RTL trace for detailed call info
-    call_trace, func_call_count, pc_history = parse_rtl_trace(trace_file, symbols)
+    # Parse RTL trace for both the call tree and detailed call info
+    (call_trace, func_call_count, pc_stats,
+     tree_output, stack_size_cache, counts) = parse_rtl_trace_unified(trace_file, resolve, stack_sizes)
     
     # Generate report
-    generate_call_trace_report(output_file, call_trace, func_call_count, pc_history, tree_output, stack_size_cache)
+    generate_call_trace_report(output_file, call_trace, func_call_count, pc_stats, tree_output, stack_size_cache,
+                               counts)
     
     print(f"\nReport generated: {output_file}")
-    print(f"Total function transitions: {len(call_trace)}")
+    print(f"Total function transitions: {counts['transitions']}")
     print(f"Unique functions called: {len(func_call_count)}")
-    print(f"Call tree entries: {len(tree_output)}")
+    print(f"Call tree entries: {counts['tree_entries']}")
 
 if __name__ == "__main__":
     main()
@@ -10,182 +10,302 @@ Supports:
 """
 
 import sys
+import os
 import re
+import mmap
+import stat
 import argparse
+import filecmp
+import operator
+from array import array
+from binascii import unhexlify, Error as HexError
+from collections import namedtuple
+from contextlib import nullcontext
+from itertools import compress, count, islice
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# Trace line patterns, matched with finditer over the whole mapped file
+# RTL format: CYCLES 0xPC (0xINSTR) [optional reg/mem/csr info]
+_RTL_RE = re.compile(
+    rb'(?m)^[ \t]*\d+[ \t]+0x([0-9a-fA-F]+)[ \t]+\(0x([0-9a-fA-F]+)\)')
+# Spike formats: core   0: 0x80000000 (0x00000297) ...    (-l)
+#                core   0: 3 0x80000000 (0x00000297) ...  (--log-commits)
+_SPIKE_RE = re.compile(
+    rb'(?m)^[ \t]*core[ \t]+\d+:[ \t]+(?:\d+[ \t]+)?0x([0-9a-fA-F]+)[ \t]+\(0x([0-9a-fA-F]+)\)')
+
+# First data line of either format, used by detect_trace_type. [^\S\n]
+# is whitespace other than newline, so a match never spans two lines.
+_DETECT_RE = re.compile(
+    rb'(?m)^[^\S\n]*(?:(core[^\S\n]+\d+:)'
+    rb'|\d+[^\S\n]+0x[0-9a-fA-F]+[^\S\n]+\(0x[0-9a-fA-F]+\))')
+
+# Read buffer size for trace files (the 8 KiB default means many small reads)
+TRACE_BUFFER_SIZE = 1 << 20
+
+# Parsed trace: parallel uint64 arrays of program counters and instructions
+# (NumPy arrays, or array('Q') buffers when NumPy is not installed)
+Trace = namedtuple('Trace', ['pc', 'instr'])
+
+def _column(values):
+    """Wrap a parsed array('Q') as a NumPy array when NumPy is available"""
+    if np is None:
+        return values
+    return np.frombuffer(values, dtype=np.uint64)
+
+def _map_trace(filename):
+    """Map a trace file read-only for a single sequential scan"""
+    with open(filename, 'rb', buffering=TRACE_BUFFER_SIZE) as f:
+        st = os.fstat(f.fileno())
+        if not stat.S_ISREG(st.st_mode):
+            # Pipes and other special files cannot be mapped; read them whole
+            return nullcontext(f.read())
+        if st.st_size == 0:
+            # mmap cannot map an empty file
+            return nullcontext(b'')
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, 'MADV_SEQUENTIAL'):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+    return mm
+
+def _hex(digits):
+    """Value of a hex digit string from a trace line"""
+    # unhexlify + from_bytes is a faster C path than int(x, 16), but only
+    # takes an even number of digits
+    try:
+        return int.from_bytes(unhexlify(digits), 'big')
+    except HexError:
+        return int(digits, 16)
+
+def _parse(regex, buf):
+    """Trace of the (pc, instr) pairs regex finds in a trace buffer"""
+    # Growing array('Q') by append beats pre-sizing from st_size and filling
+    # by index: the typed buffer holds no per-entry objects and amortized
+    # resizing is cheaper than the extra index bookkeeping in the loop
+    pcs = array('Q')
+    instrs = array('Q')
+    for m in regex.finditer(buf):
+        pc, instr = m.groups()
+        pcs.append(_hex(pc))
+        instrs.append(_hex(instr))
+    return Trace(_column(pcs), _column(instrs))
+
+def _parse_rtl(buf):
+    """Parse an RTL trace buffer; the cycle count is matched but not kept"""
+    return _parse(_RTL_RE, buf)
+
+def _parse_spike(buf):
+    """Parse a Spike trace buffer (both -l and --log-commits formats)"""
+    return _parse(_SPIKE_RE, buf)
+
+def _detect(buf):
+    """Format of the first RTL or Spike/rv32sim line in a trace buffer"""
+    m = _DETECT_RE.search(buf)
+    if m is None:
+        return 'unknown'
+    return 'spike' if m.group(1) else 'rtl'
+
+_PARSERS = {'rtl': _parse_rtl, 'spike': _parse_spike}
+_ENTRY_RES = {'rtl': _RTL_RE, 'spike': _SPIKE_RE}
 
 def parse_rtl_trace(filename):
-    """Parse RTL trace file (format: CYCLES PC (INSTR) ...)"""
-    traces = []
-    with open(filename, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-            # Expected format: CYCLES 0xPC (0xINSTR) [optional reg/mem/csr info]
-            match = re.match(r'(\d+)\s+0x([0-9a-fA-F]+)\s+\(0x([0-9a-fA-F]+)\)', line)
-            if match:
-                cycle, pc, instr = match.groups()
-                traces.append({
-                    'cycle': int(cycle),
-                    'pc': int(pc, 16),
-                    'instr': int(instr, 16),
-                    'line': line
-                })
-    return traces
+    """Parse RTL trace file (format: CYCLES PC (INSTR) ...) into a Trace"""
+    with _map_trace(filename) as buf:
+        return _parse_rtl(buf)
 
 def parse_spike_trace(filename):
     """Parse Spike trace file (handles both -l and --log-commits formats)"""
-    traces = []
-    with open(filename, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            # Try Spike format with -l flag: core   0: 0x80000000 (0x00000297) ...
-            match = re.match(r'core\s+\d+:\s+0x([0-9a-fA-F]+)\s+\(0x([0-9a-fA-F]+)\)', line)
-            if match:
-                pc, instr = match.groups()
-                traces.append({
-                    'pc': int(pc, 16),
-                    'instr': int(instr, 16),
-                    'line': line
-                })
-                continue
-            # Try Spike format with --log-commits: core   0: 3 0x80000000 (0x00000297) ...
-            match = re.match(r'core\s+\d+:\s+\d+\s+0x([0-9a-fA-F]+)\s+\(0x([0-9a-fA-F]+)\)', line)
-            if match:
-                pc, instr = match.groups()
-                traces.append({
-                    'pc': int(pc, 16),
-                    'instr': int(instr, 16),
-                    'line': line
-                })
-    return traces
+    with _map_trace(filename) as buf:
+        return _parse_spike(buf)
 
 def detect_trace_type(filename):
     """Detect if this is an RTL trace or Spike/rv32sim trace"""
-    with open(filename, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-            # RTL format starts with cycle count (number without 'core')
-            if re.match(r'^\d+\s+0x[0-9a-fA-F]+\s+\(0x[0-9a-fA-F]+\)', line):
-                return 'rtl'
-            # Spike/rv32sim format starts with 'core'
-            if re.match(r'^core\s+\d+:', line):
-                return 'spike'
-    return 'unknown'
+    with _map_trace(filename) as buf:
+        return _detect(buf)
+
+def load_trace(filename):
+    """Detect the format of a trace file and parse it from the same mapping
+
+    Returns (type, trace); trace is None when the format is unknown.
+    """
+    with _map_trace(filename) as buf:
+        kind = _detect(buf)
+        if kind == 'unknown':
+            return kind, None
+        return kind, _PARSERS[kind](buf)
+
+def identical_traces(file1, file2):
+    """Format of two byte-identical trace files, or None
+
+    Only regular files holding at least one trace entry qualify, so that a
+    short-circuited comparison passes exactly when a full one would.
+    """
+    # Pipes cannot be compared without consuming them
+    if not (os.path.isfile(file1) and os.path.isfile(file2)):
+        return None
+    if not filecmp.cmp(file1, file2, shallow=False):
+        return None
+    with _map_trace(file1) as buf:
+        kind = _detect(buf)
+        if kind == 'unknown' or _ENTRY_RES[kind].search(buf) is None:
+            return None
+    return kind
+
+def _align_offset(pcs, start_pc):
+    """Index of the first entry at start_pc, or 0 if there is none"""
+    if np is None:
+        try:
+            return pcs.index(start_pc)
+        except ValueError:
+            return 0
+    if len(pcs) == 0:
+        return 0
+    # argmax returns the first True index, and 0 when nothing matches
+    return int((pcs == start_pc).argmax())
+
+def _first_mismatches(pc1, instr1, pc2, instr2, limit):
+    """Indices of the first `limit` entries where two aligned traces differ"""
+    if np is None:
+        # Lazy element-wise compare that stops after `limit` mismatches
+        differs = map(operator.or_, map(operator.ne, pc1, pc2),
+                      map(operator.ne, instr1, instr2))
+        return list(islice(compress(count(), differs), limit))
+    return np.flatnonzero((pc1 != pc2) | (instr1 != instr2))[:limit]
+
+if njit is not None and np is not None:
+    # With Numba available, stop scanning as soon as `limit` mismatches are found
+    @njit(cache=True)
+    def _first_mismatches(pc1, instr1, pc2, instr2, limit):
+        found = np.empty(limit, dtype=np.int64)
+        n = 0
+        for i in range(len(pc1)):
+            if pc1[i] != pc2[i] or instr1[i] != instr2[i]:
+                found[n] = i
+                n += 1
+                if n == limit:
+                    break
+        return found[:n]
 
 def compare_traces(traces1, traces2, name1="Trace1", name2="Trace2"):
     """Compare two traces (generic comparison)"""
-    print(f"{name1} entries: {len(traces1)}")
-    print(f"{name2} entries: {len(traces2)}")
+    pc1, instr1 = traces1
+    pc2, instr2 = traces2
+    len1, len2 = len(pc1), len(pc2)
+    print(f"{name1} entries: {len1}")
+    print(f"{name2} entries: {len2}")
 
     # Fail if either trace is empty
-    if len(traces1) == 0 or len(traces2) == 0:
+    if len1 == 0 or len2 == 0:
         print(f"\n[FAIL] One or both traces are empty")
         return 1
 
     # Find where traces align (skip bootloader if necessary)
-    trace1_start_pc = traces1[0]['pc']
-    trace2_offset = 0
-    for i, entry in enumerate(traces2):
-        if entry['pc'] == trace1_start_pc:
-            trace2_offset = i
-            if trace2_offset > 0:
-                print(f"Aligning traces: {name2} offset = {trace2_offset} (skipping bootloader)")
-            break
-
-    if trace2_offset == 0 and trace1_start_pc != traces2[0]['pc']:
-        print(f"\n[FAIL] Cannot align traces - {name1} starts at 0x{trace1_start_pc:08x}, {name2} starts at 0x{traces2[0]['pc']:08x}")
-        return 1
+    trace1_start_pc = int(pc1[0])
+    trace2_offset = _align_offset(pc2, trace1_start_pc)
+    if trace2_offset > 0:
+        print(f"Aligning traces: {name2} offset = {trace2_offset} (skipping bootloader)")
 
-    mismatches = 0
-    max_compare = min(len(traces1), len(traces2) - trace2_offset)
-
-    for i in range(max_compare):
-        t1 = traces1[i]
-        t2 = traces2[i + trace2_offset]
-
-        if t1['pc'] != t2['pc'] or t1['instr'] != t2['instr']:
-            print(f"\nMismatch at entry {i}:")
-            print(f"  {name1:10s}: PC=0x{t1['pc']:08x} INSTR=0x{t1['instr']:08x}")
-            print(f"  {name2:10s}: PC=0x{t2['pc']:08x} INSTR=0x{t2['instr']:08x}")
-            mismatches += 1
-            if mismatches >= 10:
-                print("\n... stopping after 10 mismatches")
-                break
+    if trace2_offset == 0 and trace1_start_pc != pc2[0]:
+        print(f"\n[FAIL] Cannot align traces - {name1} starts at 0x{trace1_start_pc:08x}, {name2} starts at 0x{int(pc2[0]):08x}")
+        return 1
 
-    effective_trace2_len = len(traces2) - trace2_offset
+    max_compare = min(len1, len2 - trace2_offset)
+    end = trace2_offset + max_compare
+
+    diff = _first_mismatches(pc1[:max_compare], instr1[:max_compare],
+                             pc2[trace2_offset:end], instr2[trace2_offset:end], 10)
+
+    # Format the mismatch report in one buffer and write it at once
+    out = []
+    for i in diff:
+        j = i + trace2_offset
+        out.append(f"\nMismatch at entry {i}:\n"
+                   f"  {name1:10s}: PC=0x{int(pc1[i]):08x} INSTR=0x{int(instr1[i]):08x}\n"
+                   f"  {name2:10s}: PC=0x{int(pc2[j]):08x} INSTR=0x{int(instr2[j]):08x}\n")
+    mismatches = len(out)
+    if mismatches >= 10:
+        out.append("\n... stopping after 10 mismatches\n")
+    sys.stdout.writelines(out)
+
+    effective_trace2_len = len2 - trace2_offset
     if mismatches == 0:
-        if len(traces1) == effective_trace2_len:
+        if len1 == effective_trace2_len:
             print(f"\n[PASS] Traces match perfectly!")
             return 0
-        elif len(traces1) < effective_trace2_len:
-            print(f"\n[PASS] All {len(traces1)} {name1} instructions match {name2}")
-            print(f"  ({name2} continued for {effective_trace2_len - len(traces1)} more instructions)")
+        elif len1 < effective_trace2_len:
+            print(f"\n[PASS] All {len1} {name1} instructions match {name2}")
+            print(f"  ({name2} continued for {effective_trace2_len - len1} more instructions)")
             return 0
         else:
-            print(f"\n[PASS] All {name2} instructions matched, but {name1} has {len(traces1) - effective_trace2_len} extra entries")
+            print(f"\n[PASS] All {name2} instructions matched, but {name1} has {len1 - effective_trace2_len} extra entries")
             return 0
     else:
         print(f"\n[FAIL] Found {mismatches} mismatches")
-        if len(traces1) != effective_trace2_len:
-            print(f"  Length mismatch: {name1}={len(traces1)} {name2}={effective_trace2_len}")
+        if len1 != effective_trace2_len:
+            print(f"  Length mismatch: {name1}={len1} {name2}={effective_trace2_len}")
         return 1
 
 def compare_three_way(rtl_traces, spike_traces, rv32sim_traces):
     """Three-way comparison of RTL, Spike, and rv32sim traces"""
+    rtl_pc, rtl_instr = rtl_traces
+    spike_pc, spike_instr = spike_traces
+    rv32_pc, rv32_instr = rv32sim_traces
+
     print("=== Three-Way Trace Comparison ===\n")
-    print(f"RTL entries:     {len(rtl_traces)}")
-    print(f"Spike entries:   {len(spike_traces)}")
-    print(f"rv32sim entries: {len(rv32sim_traces)}\n")
+    print(f"RTL entries:     {len(rtl_pc)}")
+    print(f"Spike entries:   {len(spike_pc)}")
+    print(f"rv32sim entries: {len(rv32_pc)}\n")
 
     # Align all three traces
-    rtl_start = rtl_traces[0]['pc'] if rtl_traces else 0
-    spike_offset = 0
-    rv32sim_offset = 0
-
-    for i, entry in enumerate(spike_traces):
-        if entry['pc'] == rtl_start:
-            spike_offset = i
-            break
-
-    for i, entry in enumerate(rv32sim_traces):
-        if entry['pc'] == rtl_start:
-            rv32sim_offset = i
-            break
+    rtl_start = int(rtl_pc[0]) if len(rtl_pc) else 0
+    spike_offset = _align_offset(spike_pc, rtl_start)
+    rv32sim_offset = _align_offset(rv32_pc, rtl_start)
 
     if spike_offset > 0:
         print(f"Spike alignment offset: {spike_offset}")
     if rv32sim_offset > 0:
         print(f"rv32sim alignment offset: {rv32sim_offset}")
 
-    mismatches = 0
     max_compare = min(
-        len(rtl_traces),
-        len(spike_traces) - spike_offset,
-        len(rv32sim_traces) - rv32sim_offset
+        len(rtl_pc),
+        len(spike_pc) - spike_offset,
+        len(rv32_pc) - rv32sim_offset
     )
-
-    for i in range(max_compare):
-        rtl = rtl_traces[i]
-        spike = spike_traces[i + spike_offset]
-        rv32 = rv32sim_traces[i + rv32sim_offset]
-
-        all_match = (rtl['pc'] == spike['pc'] == rv32['pc'] and
-                     rtl['instr'] == spike['instr'] == rv32['instr'])
-
-        if not all_match:
-            print(f"\nMismatch at entry {i}:")
-            print(f"  RTL:     PC=0x{rtl['pc']:08x} INSTR=0x{rtl['instr']:08x}")
-            print(f"  Spike:   PC=0x{spike['pc']:08x} INSTR=0x{spike['instr']:08x}")
-            print(f"  rv32sim: PC=0x{rv32['pc']:08x} INSTR=0x{rv32['instr']:08x}")
-            mismatches += 1
-            if mismatches >= 10:
-                print("\n... stopping after 10 mismatches")
-                break
+    spike_end = spike_offset + max_compare
+    rv32_end = rv32sim_offset + max_compare
+
+    # The first 10 three-way mismatches are the first 10 of the union of
+    # the first 10 RTL-vs-Spike and RTL-vs-rv32sim mismatches
+    rtl_pc_n, rtl_instr_n = rtl_pc[:max_compare], rtl_instr[:max_compare]
+    spike_diff = _first_mismatches(rtl_pc_n, rtl_instr_n,
+                                   spike_pc[spike_offset:spike_end], spike_instr[spike_offset:spike_end], 10)
+    rv32_diff = _first_mismatches(rtl_pc_n, rtl_instr_n,
+                                  rv32_pc[rv32sim_offset:rv32_end], rv32_instr[rv32sim_offset:rv32_end], 10)
+    if np is None:
+        diff = sorted(set(spike_diff).union(rv32_diff))[:10]
+    else:
+        diff = np.union1d(spike_diff, rv32_diff)[:10]
+
+    out = []
+    for i in diff:
+        s = i + spike_offset
+        r = i + rv32sim_offset
+        out.append(f"\nMismatch at entry {i}:\n"
+                   f"  RTL:     PC=0x{int(rtl_pc[i]):08x} INSTR=0x{int(rtl_instr[i]):08x}\n"
+                   f"  Spike:   PC=0x{int(spike_pc[s]):08x} INSTR=0x{int(spike_instr[s]):08x}\n"
+                   f"  rv32sim: PC=0x{int(rv32_pc[r]):08x} INSTR=0x{int(rv32_instr[r]):08x}\n")
+    mismatches = len(out)
+    if mismatches >= 10:
+        out.append("\n... stopping after 10 mismatches\n")
+    sys.stdout.writelines(out)
 
     if mismatches == 0:
         print(f"\n[PASS] All three traces match for {max_compare} instructions!")
@@ -239,31 +359,27 @@ Examples:
             print(f"  Trace 1: {args.trace1}")
             print(f"  Trace 2: {args.trace2}\n")
 
-            # Auto-detect trace formats
-            type1 = detect_trace_type(args.trace1)
-            type2 = detect_trace_type(args.trace2)
+            # Identical files match without parsing either one
+            kind = identical_traces(args.trace1, args.trace2)
+            if kind is not None:
+                print(f"Detected formats: {kind} vs {kind}\n")
+                print(f"[PASS] Trace files are identical")
+                sys.exit(0)
+
+            # Auto-detect trace formats, parsing each file from one mapping
+            type1, traces1 = load_trace(args.trace1)
+            type2, traces2 = load_trace(args.trace2)
 
             print(f"Detected formats: {type1} vs {type2}\n")
 
-            if type1 == 'rtl':
-                traces1 = parse_rtl_trace(args.trace1)
-                name1 = "RTL"
-            elif type1 == 'spike':
-                traces1 = parse_spike_trace(args.trace1)
-                name1 = "Trace1"
-            else:
+            if traces1 is None:
                 print(f"Error: Unknown format for {args.trace1}")
                 sys.exit(1)
-
-            if type2 == 'rtl':
-                traces2 = parse_rtl_trace(args.trace2)
-                name2 = "RTL"
-            elif type2 == 'spike':
-                traces2 = parse_spike_trace(args.trace2)
-                name2 = "Trace2"
-            else:
+            if traces2 is None:
                 print(f"Error: Unknown format for {args.trace2}")
                 sys.exit(1)
+            name1 = "RTL" if type1 == 'rtl' else "Trace1"
+            name2 = "RTL" if type2 == 'rtl' else "Trace2"
 
             result = compare_traces(traces1, traces2, name1, name2)
             sys.exit(result)
@@ -1,18 +1,13 @@
 import os
-import re
-import shutil
-import subprocess
-import shlex
 import logging
-import random
-import string
-from string import Template
 import sys
 
-import riscof.utils as utils
-import riscof.constants as constants
 from riscof.pluginTemplate import pluginTemplate
 
+# Helpers shared by the plugins live next to the config files
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import plugin_common
+
 logger = logging.getLogger()
 
 class kcore(pluginTemplate):
@@ -33,48 +28,23 @@ class kcore(pluginTemplate):
         config_dir = os.getcwd()
 
         # Resolve paths - if relative, make them relative to config directory
-        # If absolute, use as-is
-        pluginpath_raw = config['pluginpath']
-        if not os.path.isabs(pluginpath_raw):
-            self.pluginpath = os.path.abspath(os.path.join(config_dir, pluginpath_raw))
-        else:
-            self.pluginpath = os.path.abspath(pluginpath_raw)
+        self.pluginpath = plugin_common.resolve_path(config_dir, config['pluginpath'])
 
         self.num_jobs = str(config['jobs'] if 'jobs' in config else 1)
+        # Test worker pool, started on the first runTests call
+        self._pool = None
 
-        ispec_raw = config['ispec']
-        if not os.path.isabs(ispec_raw):
-            self.isa_spec = os.path.abspath(os.path.join(config_dir, ispec_raw))
-        else:
-            self.isa_spec = os.path.abspath(ispec_raw)
+        self.isa_spec = plugin_common.resolve_path(config_dir, config['ispec'])
 
-        pspec_raw = config['pspec']
-        if not os.path.isabs(pspec_raw):
-            self.platform_spec = os.path.abspath(os.path.join(config_dir, pspec_raw))
-        else:
-            self.platform_spec = os.path.abspath(pspec_raw)
+        self.platform_spec = plugin_common.resolve_path(config_dir, config['pspec'])
 
         # Get paths from project root
         self.project_root = os.path.abspath(os.path.join(self.pluginpath, '../../../'))
 
         # Load environment configuration
-        env_config_path = os.path.join(self.project_root, 'env.config')
-        self.riscv_prefix = None
-        self.verilator_bin = None
-
-        if os.path.exists(env_config_path):
-            with open(env_config_path, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line.startswith('RISCV_PREFIX='):
-                        self.riscv_prefix = line.split('=', 1)[1]
-                    elif line.startswith('VERILATOR='):
-                        self.verilator_bin = line.split('=', 1)[1]
-
-        if not self.riscv_prefix:
-            self.riscv_prefix = 'riscv32-unknown-elf-'
-        if not self.verilator_bin:
-            self.verilator_bin = 'verilator'
+        env_config = plugin_common.load_env_config(self.project_root)
+        self.riscv_prefix = env_config.get('RISCV_PREFIX') or 'riscv32-unknown-elf-'
+        self.verilator_bin = env_config.get('VERILATOR') or 'verilator'
 
         # Path to Verilator executable
         self.dut_exe = os.path.join(self.project_root, 'build/verilator/kcore_vsim')
@@ -88,44 +58,21 @@ class kcore(pluginTemplate):
        self.work_dir = work_dir
        self.suite_dir = suite
 
-       # Compile command using project's toolchain
-       self.compile_cmd = self.riscv_prefix + 'gcc -march={0} \
-         -static -mcmodel=medany -fvisibility=hidden -nostdlib -nostartfiles -g\
-         -T '+self.pluginpath+'/env/link.ld\
-         -I '+self.pluginpath+'/env/\
-         -I ' + archtest_env + ' {2} -o {3} {4}'
+       # Compile flags using project's toolchain
+       # runTests adds -march, the test, the ELF, the macros and the ABI
+       self.compile_flags = ['-static', '-mcmodel=medany', '-fvisibility=hidden', '-nostdlib', '-nostartfiles', '-g',
+                             '-T', self.pluginpath + '/env/link.ld',
+                             '-I', self.pluginpath + '/env/',
+                             '-I', archtest_env]
 
     def build(self, isa_yaml, platform_yaml):
-      ispec = utils.load_yaml(isa_yaml)['hart0']
-      self.xlen = ('64' if 64 in ispec['supported_xlen'] else '32')
-
-      self.isa = 'rv' + self.xlen
-      if "I" in ispec["ISA"]:
-          self.isa += 'i'
-      if "M" in ispec["ISA"]:
-          self.isa += 'm'
-      if "A" in ispec["ISA"]:
-          self.isa += 'a'
-      if "F" in ispec["ISA"]:
-          self.isa += 'f'
-      if "D" in ispec["ISA"]:
-          self.isa += 'd'
-      if "C" in ispec["ISA"]:
-          self.isa += 'c'
-      if "Zicsr" in ispec["ISA"]:
-          self.isa += '_zicsr'
-      if "Zifencei" in ispec["ISA"]:
-          self.isa += '_zifencei'
-
-      self.compile_cmd = self.compile_cmd + ' -mabi=' + ('lp64 ' if 64 in ispec['supported_xlen'] else 'ilp32 ')
-
-    def runTests(self, testList):
-      if os.path.exists(self.work_dir + "/Makefile." + self.name[:-1]):
-            os.remove(self.work_dir + "/Makefile." + self.name[:-1])
+      ispec = plugin_common.load_hart_spec(isa_yaml)
+      self.isa, self.xlen = plugin_common.isa_string(ispec)
 
-      make = utils.makeUtil(makefilePath=os.path.join(self.work_dir, "Makefile." + self.name[:-1]))
-      make.makeCommand = 'make -k -j' + self.num_jobs
+      self.compile_abi = '-mabi=' + ('lp64' if 64 in ispec['supported_xlen'] else 'ilp32')
 
+    def runTests(self, testList):
+      tasks = []
       for testname in testList:
           testentry = testList[testname]
           test = testentry['test_path']
@@ -133,33 +80,44 @@ class kcore(pluginTemplate):
           elf = os.path.join(test_dir, testname + '.elf')
           sig_file = os.path.join(test_dir, self.name[:-1] + ".signature")
 
-          compile_macros = ' -D' + " -D".join(testentry['macros'])
+          compile_macros = ['-D' + macro for macro in testentry['macros']]
 
           # Compile command
-          cmd = self.compile_cmd.format(testentry['isa'].lower(), self.xlen, test, elf, compile_macros)
+          cmd = ([self.riscv_prefix + 'gcc', '-march=' + testentry['isa'].lower()] + self.compile_flags
+                 + [test, '-o', elf] + compile_macros + [self.compile_abi])
 
           if self.target_run:
             # Run on Verilator with signature extraction using ELF file directly
             # The simulator will automatically extract begin_signature and end_signature from ELF
-            # Pass RISCOF_DEBUG environment variable if set
-            debug_prefix = ''
-            trace_arg = ''
-            if os.environ.get('RISCOF_DEBUG', '0') == '1':
-                debug_prefix = 'export RISCOF_DEBUG=1; '
-                trace_arg = '+TRACE'
+            # RISCOF_DEBUG is inherited from this environment; when set, also enable +TRACE
 
             # Run simulation with signature extraction
             # +signature= tells the simulator to write signature to file
             # +signature-granularity=4 specifies 4-byte (32-bit) words
-            simcmd = debug_prefix + '{0} +PROGRAM={1} +MAX_CYCLES=100000 +signature={2} +signature-granularity=4 {3} > {2}.log 2>&1'.format(
-                self.dut_exe, elf, sig_file, trace_arg)
+            simcmd = [self.dut_exe, '+PROGRAM=' + elf, '+MAX_CYCLES=100000',
+                      '+signature=' + sig_file, '+signature-granularity=4']
+            if os.environ.get('RISCOF_DEBUG', '0') == '1':
+                simcmd.append('+TRACE')
           else:
-            simcmd = 'echo "NO RUN"'
-
-          execute = '@cd {0}; {1}; {2};'.format(test_dir, cmd, simcmd)
-          make.add_target(execute)
-
-      make.execute_all(self.work_dir)
+            simcmd = None
+
+          tasks.append((test_dir, cmd, simcmd, sig_file + '.log'))
+
+      # One compile+simulate job per test, num_jobs at a time
+      # (RISCOF_USE_MAKE=1 runs them through a generated Makefile instead)
+      if os.environ.get('RISCOF_USE_MAKE'):
+          plugin_common.run_tests_make(tasks, os.path.join(self.work_dir, "Makefile." + self.name[:-1]),
+                                       'make -k -j' + self.num_jobs, self.work_dir)
+      else:
+          if self._pool is None:
+              self._pool = plugin_common.start_pool(self.num_jobs)
+          results = plugin_common.run_tests(self._pool, tasks,
+                                            os.path.join(self.work_dir, '.riscof-timings.' + self.name[:-1] + '.json'))
+
+          # rc is None when only compiling
+          for testname, rc in zip(testList, results):
+              if rc not in (0, None):
+                  logger.error("kcore failed on {0} (exit code {1})".format(testname, rc))
 
       if not self.target_run:
           raise SystemExit(0)
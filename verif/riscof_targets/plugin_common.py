@@ -0,0 +1,267 @@
+"""
+Helpers shared by the kcore, rv32sim and spike RISCOF plugins
+"""
+
+import os
+import atexit
+import functools
+import shlex
+import shutil
+import hashlib
+import json
+import time
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# Exit code reported for a simulator stopped at its time limit (as timeout(1))
+TIMEOUT_RC = 124
+
+# Exit code reported for a command that could not be started (as the shell)
+NOT_STARTED_RC = 127
+
+# Compiled test ELFs kept across runs when RISCOF_CCACHE=1
+ELF_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'kcore-riscof')
+
+# ISA string suffix for each extension that can appear in an ISA spec, in order
+ISA_EXTENSIONS = (
+    ('I', 'i'), ('M', 'm'), ('A', 'a'), ('F', 'f'), ('D', 'd'), ('C', 'c'),
+    ('Zicsr', '_zicsr'), ('Zifencei', '_zifencei'),
+)
+
+def isa_string(ispec):
+    """(isa, xlen) for a hart ISA spec, e.g. ('rv32ima_zicsr', '32')"""
+    xlen = '64' if 64 in ispec['supported_xlen'] else '32'
+    isa = 'rv' + xlen + ''.join(ext for name, ext in ISA_EXTENSIONS if name in ispec['ISA'])
+    return isa, xlen
+
+def resolve_path(config_dir, path):
+    """Absolute form of a config path; relative paths are taken from config_dir"""
+    # join() keeps absolute paths as they are
+    return os.path.abspath(os.path.join(config_dir, path))
+
+@functools.lru_cache(maxsize=None)
+def _load_yaml(path, mtime_ns):
+    import riscof.utils as utils
+    return utils.load_yaml(path)
+
+def load_hart_spec(isa_yaml):
+    """hart0 section of an ISA spec YAML
+
+    RISCOF passes the same checked ISA YAML to the DUT and the reference
+    plugin's build(), so it is parsed once per run (and again only if the
+    file changes).
+    """
+    path = os.path.abspath(isa_yaml)
+    return _load_yaml(path, os.stat(path).st_mtime_ns)['hart0']
+
+@functools.lru_cache(maxsize=None)
+def load_env_config(project_root):
+    """KEY=VALUE settings from the project's env.config, read once per run
+
+    Returns an empty dict if the file does not exist.
+    """
+    env = {}
+    env_config_path = os.path.join(project_root, 'env.config')
+    if os.path.exists(env_config_path):
+        with open(env_config_path, 'r') as f:
+            for line in f:
+                key, sep, value = line.strip().partition('=')
+                if sep:
+                    env[key] = value
+    return env
+
+def run_test(test_dir, compile_argv, sim_argv, log_path, sim_timeout=None):
+    """Compile one test and run it, with the simulator output in log_path
+
+    Both commands are argv lists, run directly without a shell. sim_argv is
+    None when the target is not run; a simulator still running after
+    sim_timeout seconds is stopped with SIGTERM, like timeout(1) does (spike
+    writes its signature when it handles that signal). Returns the
+    simulator exit code (TIMEOUT_RC if it was stopped), the compiler's if
+    compiling failed, NOT_STARTED_RC (with the error in log_path) if either
+    command could not be started, or None if nothing was simulated.
+    """
+    try:
+        if os.environ.get('RISCOF_CCACHE') == '1':
+            rc = _compile_cached(test_dir, compile_argv)
+        else:
+            rc = subprocess.run(compile_argv, cwd=test_dir).returncode
+    except OSError as e:
+        # Compiler not found (or ELF cache not writable): record it and
+        # let the other tests run
+        with open(log_path, 'w') as log:
+            log.write('{0}: {1}\n'.format(compile_argv[0], e))
+        return NOT_STARTED_RC
+    if rc != 0:
+        return rc
+    if sim_argv is None:
+        return None
+    with open(log_path, 'w') as log:
+        try:
+            proc = subprocess.Popen(sim_argv, cwd=test_dir, stdout=log, stderr=subprocess.STDOUT)
+        except OSError as e:
+            # Simulator not built (or not executable)
+            log.write('{0}: {1}\n'.format(sim_argv[0], e))
+            return NOT_STARTED_RC
+        with proc:
+            try:
+                return proc.wait(timeout=sim_timeout)
+            except subprocess.TimeoutExpired:
+                proc.terminate()
+                proc.wait()
+                return TIMEOUT_RC
+
+def _compile_cached(test_dir, compile_argv):
+    """Compile, or reuse the ELF from ELF_CACHE_DIR when no input changed"""
+    elf = os.path.join(test_dir, compile_argv[compile_argv.index('-o') + 1])
+    cached = os.path.join(ELF_CACHE_DIR, _compile_key(compile_argv) + '.elf')
+    if os.path.exists(cached):
+        _place_file(cached, elf)
+        return 0
+    rc = subprocess.run(compile_argv, cwd=test_dir).returncode
+    if rc == 0:
+        os.makedirs(ELF_CACHE_DIR, exist_ok=True)
+        _place_file(elf, cached)
+    return rc
+
+def _compile_key(compile_argv):
+    """Hash of a compile command, the inputs it names and the compiler
+
+    Input files (test source, linker script) and the files under -I
+    directories are identified by path, size and mtime. The output ELF is
+    left out, so tests built the same way into different directories (or by
+    different plugins) share an entry.
+    """
+    output = compile_argv[compile_argv.index('-o') + 1]
+    h = hashlib.blake2b(digest_size=16)
+    h.update(repr(_tool_stamp(compile_argv[0])).encode())
+    for i, arg in enumerate(compile_argv):
+        if arg == output:
+            continue
+        h.update(arg.encode() + b'\0')
+        if i > 0 and compile_argv[i - 1] == '-I':
+            h.update(repr(_dir_stamp(arg)).encode())
+        elif os.path.isfile(arg):
+            st = os.stat(arg)
+            h.update(repr((st.st_size, st.st_mtime_ns)).encode())
+    return h.hexdigest()
+
+@functools.lru_cache(maxsize=None)
+def _tool_stamp(tool):
+    path = shutil.which(tool)
+    if path is None:
+        return None
+    st = os.stat(path)
+    return (path, st.st_size, st.st_mtime_ns)
+
+@functools.lru_cache(maxsize=None)
+def _dir_stamp(path):
+    """(relative path, size, mtime) of every file under an include directory"""
+    stamp = []
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            file_path = os.path.join(root, name)
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                continue
+            stamp.append((os.path.relpath(file_path, path), st.st_size, st.st_mtime_ns))
+    return sorted(stamp)
+
+def _place_file(src, dst):
+    """Hard-link src to dst (copying across filesystems), replacing dst"""
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        # Already linked by an earlier run (rename() would be a no-op)
+        return
+    tmp = '{0}.{1}.{2}.tmp'.format(dst, os.getpid(), threading.get_ident())
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+def start_pool(num_jobs):
+    """Worker pool kept for the life of a plugin and shut down at exit
+
+    Workers only wait on gcc and the simulators, which releases the GIL, so
+    threads are enough and tasks need no pickling or extra processes.
+    """
+    pool = ThreadPoolExecutor(max_workers=int(num_jobs))
+    atexit.register(pool.shutdown)
+    return pool
+
+def run_tests(pool, tasks, timings_path=None):
+    """Run (test_dir, compile_argv, sim_argv, log_path[, sim_timeout]) tasks in parallel
+
+    Tasks are started longest first, so a slow test does not end up in the
+    last batch with the other workers idle. Run times from the previous run
+    are kept in timings_path (by test directory); tests without one go first,
+    largest compile inputs first. Returns the run_test exit codes in task
+    order.
+    """
+    if not tasks:
+        return []
+    timings = _load_timings(timings_path)
+    order = sorted(range(len(tasks)), reverse=True,
+                   key=lambda i: (timings.get(tasks[i][0], float('inf')), _input_size(tasks[i][1])))
+    futures = {i: pool.submit(_timed_run_test, *tasks[i]) for i in order}
+    results = []
+    for i, task in enumerate(tasks):
+        rc, elapsed = futures[i].result()
+        timings[task[0]] = elapsed
+        results.append(rc)
+    if timings_path is not None:
+        tmp = '{0}.{1}.tmp'.format(timings_path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(timings, f, indent=1, sort_keys=True)
+        os.replace(tmp, timings_path)
+    return results
+
+def _timed_run_test(*task):
+    start = time.monotonic()
+    rc = run_test(*task)
+    return rc, time.monotonic() - start
+
+def _load_timings(timings_path):
+    if timings_path is None:
+        return {}
+    try:
+        with open(timings_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _input_size(compile_argv):
+    """Total size of the existing input files a compile command names
+
+    The output ELF is left out: one left by an earlier run says nothing about
+    the source.
+    """
+    output = compile_argv[compile_argv.index('-o') + 1]
+    return sum(os.path.getsize(arg) for arg in compile_argv[1:]
+               if arg != output and os.path.isfile(arg))
+
+def run_tests_make(tasks, makefile_path, make_command, work_dir):
+    """Run tasks through a generated Makefile (RISCOF_USE_MAKE=1 fallback)"""
+    # Only this opt-in path needs makeUtil
+    import riscof.utils as utils
+    # makeUtil appends targets, so start from an empty Makefile
+    try:
+        os.unlink(makefile_path)
+    except FileNotFoundError:
+        pass
+    make = utils.makeUtil(makefilePath=makefile_path)
+    make.makeCommand = make_command
+    for test_dir, compile_argv, sim_argv, log_path, *sim_timeout in tasks:
+        execute = '@cd {0}; {1}'.format(shlex.quote(test_dir), _make_command_line(compile_argv))
+        if sim_argv is not None:
+            if sim_timeout and sim_timeout[0] is not None:
+                sim_argv = ['timeout', str(sim_timeout[0])] + sim_argv
+            execute += '; {0} > {1} 2>&1'.format(_make_command_line(sim_argv), shlex.quote(log_path))
+        make.add_target(execute + ';')
+    make.execute_all(work_dir)
+
+def _make_command_line(argv):
+    """Quote argv for a make recipe (make expands $ before the shell runs)"""
+    return ' '.join(shlex.quote(arg) for arg in argv).replace('$', '$$')
@@ -1,20 +1,19 @@
 import os
-import re
-import shutil
-import subprocess
-import shlex
 import logging
-import random
-import string
-from string import Template
 import sys
 
-import riscof.utils as utils
-import riscof.constants as constants
 from riscof.pluginTemplate import pluginTemplate
 
+# Helpers shared by the plugins live next to the config files
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import plugin_common
+
 logger = logging.getLogger()
 
+# Seconds spike may run before it is stopped (it keeps running after the
+# signature is written)
+SPIKE_TIMEOUT = 10
+
 class spike(pluginTemplate):
     __model__ = "spike"
     __version__ = "1.0.0"
@@ -32,35 +31,21 @@ class spike(pluginTemplate):
         config_dir = os.getcwd()
 
         # Resolve pluginpath - if relative, make it relative to config directory
-        pluginpath_raw = config['pluginpath']
-        if not os.path.isabs(pluginpath_raw):
-            self.pluginpath = os.path.abspath(os.path.join(config_dir, pluginpath_raw))
-        else:
-            self.pluginpath = os.path.abspath(pluginpath_raw)
+        self.pluginpath = plugin_common.resolve_path(config_dir, config['pluginpath'])
 
         # Get paths from project root
         self.project_root = os.path.abspath(os.path.join(self.pluginpath, '../../../'))
 
         # Load environment configuration
-        env_config_path = os.path.join(self.project_root, 'env.config')
-        self.riscv_prefix = None
-        self.spike_exe = 'spike'
-
-        if os.path.exists(env_config_path):
-            with open(env_config_path, 'r') as f:
-                for line in f:
-                    line = line.strip()
-                    if line.startswith('RISCV_PREFIX='):
-                        self.riscv_prefix = line.split('=', 1)[1]
-                    elif line.startswith('SPIKE='):
-                        self.spike_exe = line.split('=', 1)[1]
-
-        if not self.riscv_prefix:
-            self.riscv_prefix = 'riscv32-unknown-elf-'
+        env_config = plugin_common.load_env_config(self.project_root)
+        self.riscv_prefix = env_config.get('RISCV_PREFIX') or 'riscv32-unknown-elf-'
+        self.spike_exe = env_config.get('SPIKE', 'spike')
 
         self.objdump_exe = self.riscv_prefix + 'objdump'
         self.dut_exe = self.spike_exe
         self.num_jobs = str(config['jobs'] if 'jobs' in config else 1)
+        # Test worker pool, started on the first runTests call
+        self._pool = None
         logger.debug("SPIKE plugin initialized")
 
     def initialise(self, suite, work_dir, archtest_env):
@@ -70,41 +55,23 @@ class spike(pluginTemplate):
         self.objdump = self.objdump_exe + ' -D'
 
     def build(self, isa_yaml, platform_yaml):
-        ispec = utils.load_yaml(isa_yaml)['hart0']
-        self.xlen = ('64' if 64 in ispec['supported_xlen'] else '32')
-        self.isa = 'rv' + self.xlen
-        if "I" in ispec["ISA"]:
-            self.isa += 'i'
-        if "M" in ispec["ISA"]:
-            self.isa += 'm'
-        if "A" in ispec["ISA"]:
-            self.isa += 'a'
-        if "F" in ispec["ISA"]:
-            self.isa += 'f'
-        if "D" in ispec["ISA"]:
-            self.isa += 'd'
-        if "C" in ispec["ISA"]:
-            self.isa += 'c'
-        if "Zicsr" in ispec["ISA"]:
-            self.isa += '_zicsr'
-        if "Zifencei" in ispec["ISA"]:
-            self.isa += '_zifencei'
+        ispec = plugin_common.load_hart_spec(isa_yaml)
+        self.isa, self.xlen = plugin_common.isa_string(ispec)
 
         # Spike ISA string (same as compile ISA)
         self.isa_spike = self.isa
 
-        # Set ABI based on xlen and build compile_cmd
-        # Format will be used later: {0}=test_path, {1}=elf_path, {2}=compile_macros
+        # Set ABI based on xlen and build the compile command
+        # runTests appends the test path, -o elf_path and the compile macros
         abi = 'lp64' if "64" in self.xlen else 'ilp32'
-        self.compile_cmd = self.riscv_prefix+'gcc -march='+self.isa.lower()+' -mabi='+abi+' \
-         -static -mcmodel=medany -fvisibility=hidden -nostdlib -nostartfiles -g\
-         -T '+self.pluginpath+'/env/link.ld \
-         -I '+self.pluginpath+'/env/\
-         -I '+self.archtest_env+' {0} -o {1} {2}'
+        self.compile_argv = [self.riscv_prefix + 'gcc', '-march=' + self.isa.lower(), '-mabi=' + abi,
+                             '-static', '-mcmodel=medany', '-fvisibility=hidden', '-nostdlib', '-nostartfiles', '-g',
+                             '-T', self.pluginpath + '/env/link.ld',
+                             '-I', self.pluginpath + '/env/',
+                             '-I', self.archtest_env]
 
     def runTests(self, testList):
-        make = utils.makeUtil(makefilePath=os.path.join(self.work_dir, "Makefile." + self.name[:-1]))
-        make.makeCommand = 'make -j' + self.num_jobs
+        tasks = []
         for testname in testList:
             testentry = testList[testname]
             test = testentry['test_path']
@@ -113,24 +80,34 @@ class spike(pluginTemplate):
             sig_file = os.path.join(test_dir, self.name[:-1] + ".signature")
 
             # Compile macros
-            compile_macros = ' -D' + " -D".join(testentry['macros'])
+            compile_macros = ['-D' + macro for macro in testentry['macros']]
 
-            # Compile command - using the base compile_cmd with proper formatting
-            cmd = self.compile_cmd.format(test, elf, compile_macros)
+            # Compile command - the base compile_argv plus this test's files and macros
+            cmd = self.compile_argv + [test, '-o', elf] + compile_macros
 
             # Spike run command - using --isa to specify ISA and +signature to dump signature
-            # Note: spike doesn't exit after RVMODEL_HALT, so we use timeout to kill it after signature is written
-            # The timeout exit code (124) is expected and should be treated as success
+            # Note: spike doesn't exit after RVMODEL_HALT, so it is killed after SPIKE_TIMEOUT seconds,
+            # once the signature is written; that timeout is expected and treated as success
             # Use --pc=0x80000000 to start at the test entry point, bypassing spike's bootrom
-            spike_cmd = 'timeout 10 ' + self.spike_exe + ' --pc=0x80000000 --isa={0} +signature={1} +signature-granularity=4 {2}'.format(
-                self.isa_spike, sig_file, elf)
+            spike_cmd = [self.spike_exe, '--pc=0x80000000', '--isa=' + self.isa_spike,
+                         '+signature=' + sig_file, '+signature-granularity=4', elf]
 
-            # Wrap spike command to treat timeout exit code 124 as success (exit 0)
-            # Use single quotes in the generated makefile to preserve shell variables
-            spike_cmd_wrapped = "bash -c '{0}; RC=$$?; if [ $$RC -eq 124 ] || [ $$RC -eq 0 ]; then exit 0; else exit $$RC; fi'".format(spike_cmd)
+            tasks.append((test_dir, cmd, spike_cmd, sig_file + '.log', SPIKE_TIMEOUT))
 
-            execute = '@cd {0}; {1}; {2} &> {3}.log'.format(test_dir, cmd, spike_cmd_wrapped, sig_file)
-            make.add_target(execute)
-
-        make.execute_all(self.work_dir)
+        # One compile+simulate job per test, num_jobs at a time
+        # (RISCOF_USE_MAKE=1 runs them through a generated Makefile instead;
+        # -k keeps make going past the expected timeout exit code)
+        if os.environ.get('RISCOF_USE_MAKE'):
+            plugin_common.run_tests_make(tasks, os.path.join(self.work_dir, "Makefile." + self.name[:-1]),
+                                         'make -k -j' + self.num_jobs, self.work_dir)
+        else:
+            if self._pool is None:
+                self._pool = plugin_common.start_pool(self.num_jobs)
+            results = plugin_common.run_tests(self._pool, tasks,
+                                              os.path.join(self.work_dir, '.riscof-timings.' + self.name[:-1] + '.json'))
+
+            # Treat the expected timeout the same as a clean exit
+            for testname, rc in zip(testList, results):
+                if rc not in (0, plugin_common.TIMEOUT_RC):
+                    logger.error("spike failed on {0} (exit code {1})".format(testname, rc))
 